@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2024 STMicroelectronics.
+# All rights reserved.
+#
+# This software is licensed under terms that can be found in the LICENSE file
+# in the root directory of this software component.
+# If no LICENSE file comes with this software, it is provided AS-IS.
+
+"""
+Measure, for each dump encoding, the bytes sent on the wire and the duration of
+a raw frame dump through a pseudo terminal acting as the USB ACM port, from the
+GET command to the end of the reply read by the host. The command server of
+stm32_isp_iqtune_com.py is run in this process on a synthetic RAW10 frame, and
+the encoding time alone is measured with the link left out.
+
+The pseudo terminal is not limited by a link throughput: on the ACM link the
+transfer time grows with the bytes on the wire.
+"""
+
+import io
+import os
+import sys
+import tty
+import time
+import zlib
+import types
+import argparse
+import contextlib
+from contextlib import contextmanager
+from struct import Struct
+
+import numpy as np
+
+from iqtune_com_pty_test import FakePipeline, read_exactly, wait_ready
+from stm32_isp_iqtune_com import IQTuneCom, SerialTransport, CmdID, CmdOperation, DumpEncoding, \
+                                 DUMP_ENCODED_HEADER_LAYOUT, DUMP_CHUNK_LAYOUT, DUMP_CRC_CHUNK_LAYOUT, pack_raw10
+
+# Format ID of the RAW10 frames
+ISP_FORMAT_RAW10 = 0x02
+
+# Layout of the SET CMD_DUMP_ENCODING command
+DUMP_ENCODING_COMMAND = Struct('<4BI')
+
+ENCODINGS = (
+  ("none", DumpEncoding.DUMP_ENCODING_NONE.value),
+  ("zlib", DumpEncoding.DUMP_ENCODING_ZLIB.value),
+  ("raw10", DumpEncoding.DUMP_ENCODING_RAW10_PACKED.value),
+  ("raw10+zlib", DumpEncoding.DUMP_ENCODING_RAW10_PACKED.value | DumpEncoding.DUMP_ENCODING_ZLIB.value),
+  ("crc", DumpEncoding.DUMP_ENCODING_CHUNKED_CRC.value),
+  ("crc+zlib", DumpEncoding.DUMP_ENCODING_CHUNKED_CRC.value | DumpEncoding.DUMP_ENCODING_ZLIB.value),
+  ("crc+raw10+zlib", DumpEncoding.DUMP_ENCODING_CHUNKED_CRC.value | DumpEncoding.DUMP_ENCODING_RAW10_PACKED.value
+                     | DumpEncoding.DUMP_ENCODING_ZLIB.value),
+)
+
+class SyntheticFrame():
+    """
+    RAW10 frame stored in 16 bits containers, mapped like a dumped frame
+    """
+    def __init__(self, pixels):
+        self.array = pixels
+        self.height, self.width = pixels.shape
+        self.pitch = pixels.strides[0]
+        self.size = pixels.nbytes
+        self.format = ISP_FORMAT_RAW10
+
+    @contextmanager
+    def map(self):
+        yield memoryview(self.array).cast('B')
+
+class DumpPipeline(FakePipeline):
+    """
+    Simulated pipeline dumping the synthetic frame on each request
+    """
+    def __init__(self, frame):
+        super().__init__()
+        self.frame = frame
+
+    def request_dump(self, stream):
+        pass
+
+    def wait_dump(self, timeout):
+        return True
+
+    def take_dump(self):
+        return self.frame
+
+def synthetic_raw10(width, height):
+    """
+    return a Bayer frame made of smooth gradients per color channel and sensor noise
+    """
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    gradient = 256 + 400 * (x / width) * (0.5 + 0.5 * y / height)
+    # the 4 pixels of the Bayer block have different gains
+    gains = np.array([[1.0, 0.6], [0.6, 0.4]])[y % 2, x % 2]
+    pixels = gradient * gains + rng.normal(0, 4, (height, width))
+    return np.clip(pixels, 0, 1023).astype('<u2')
+
+def read_dump(fd, encoding, timeout):
+    """
+    read a dump reply and return the number of bytes received and the chunks payload
+    """
+    header = read_exactly(fd, DUMP_ENCODED_HEADER_LAYOUT.size + len(b'DUMP DATA['), timeout)
+    values = DUMP_ENCODED_HEADER_LAYOUT.unpack_from(header)
+    if values[0] != CmdOperation.CMD_OP_GET_OK.value or values[-1] != encoding:
+        raise RuntimeError("dump failed")
+    received = len(header)
+    chunks = []
+    if encoding & DumpEncoding.DUMP_ENCODING_CHUNKED_CRC.value:
+        while True:
+            index, length, crc = DUMP_CRC_CHUNK_LAYOUT.unpack(read_exactly(fd, DUMP_CRC_CHUNK_LAYOUT.size, timeout))
+            received += DUMP_CRC_CHUNK_LAYOUT.size + length
+            if length == 0:
+                break
+            chunk = read_exactly(fd, length, timeout)
+            if zlib.crc32(chunk) != crc:
+                raise RuntimeError("CRC error on chunk %d" % index)
+            chunks.append(chunk)
+    elif encoding & DumpEncoding.DUMP_ENCODING_ZLIB.value:
+        while True:
+            length, = DUMP_CHUNK_LAYOUT.unpack(read_exactly(fd, DUMP_CHUNK_LAYOUT.size, timeout))
+            received += DUMP_CHUNK_LAYOUT.size + length
+            if length == 0:
+                break
+            chunks.append(read_exactly(fd, length, timeout))
+    else:
+        chunks.append(read_exactly(fd, values[4], timeout))
+        received += values[4]
+    if read_exactly(fd, len(b'DUMP DATA]'), timeout) != b'DUMP DATA]':
+        raise RuntimeError("missing dump trailer")
+    return received + len(b'DUMP DATA]'), chunks
+
+def decode_chunks(encoding, chunks):
+    if encoding & DumpEncoding.DUMP_ENCODING_ZLIB.value:
+        chunks = [zlib.decompress(chunk) for chunk in chunks]
+    return b''.join(chunks)
+
+def main():
+    parser = argparse.ArgumentParser(description="IQTune dump encoding benchmark")
+    parser.add_argument("--width", type=int, default=2592, help="width of the synthetic frame")
+    parser.add_argument("--height", type=int, default=1944, help="height of the synthetic frame")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of dumps of each encoding, the fastest one is kept")
+    args = parser.parse_args()
+
+    frame = SyntheticFrame(synthetic_raw10(args.width, args.height))
+    raw = frame.array.tobytes()
+    packed = pack_raw10(raw, frame.width, frame.height, frame.pitch).tobytes()
+
+    host_fd, device_fd = os.openpty()
+    tty.setraw(host_fd)
+    tty.setraw(device_fd)
+    app = types.SimpleNamespace(gst_widget=DumpPipeline(frame), startup_phase=lambda phase: None,
+                                sensor_pixel_depth=10)
+    com = IQTuneCom(app, SerialTransport(os.ttyname(device_fd)))
+    com.start()
+
+    results = []
+    log = io.StringIO()
+    try:
+        # the dump latency traces of the command server are left out of the results
+        with contextlib.redirect_stdout(log):
+            wait_ready(host_fd, 5.0)
+            dump_request = bytes([CmdOperation.CMD_OP_GET.value, CmdID.CMD_DUMP_RAW_FRAME.value, 0, 0])
+            for name, encoding in ENCODINGS:
+                os.write(host_fd, DUMP_ENCODING_COMMAND.pack(CmdOperation.CMD_OP_SET.value,
+                                                             CmdID.CMD_DUMP_ENCODING.value, 0, 0, encoding))
+                if read_exactly(host_fd, 2, 1.0)[0] != CmdOperation.CMD_OP_GET_OK.value:
+                    raise RuntimeError("SET CMD_DUMP_ENCODING failed")
+                durations = []
+                for _ in range(args.repeat):
+                    start = time.monotonic()
+                    os.write(host_fd, dump_request)
+                    received, chunks = read_dump(host_fd, encoding, 10.0)
+                    durations.append((time.monotonic() - start) * 1000)
+                expected = packed if encoding & DumpEncoding.DUMP_ENCODING_RAW10_PACKED.value else raw
+                if decode_chunks(encoding, chunks) != expected:
+                    raise RuntimeError("%s dump corrupted" % name)
+                results.append([name, received, min(durations)])
+
+            # encoding alone, the data sent is dropped
+            send_data = com._send_data
+            com._send_data = lambda data, flush=True: True
+            try:
+                for result, (name, encoding) in zip(results, ENCODINGS):
+                    com._dump_encoding = encoding
+                    durations = []
+                    for _ in range(args.repeat):
+                        start = time.monotonic()
+                        com._send_dump(CmdID.CMD_DUMP_RAW_FRAME.value, 'raw', frame, start)
+                        durations.append((time.monotonic() - start) * 1000)
+                    result.append(min(durations))
+            finally:
+                com._send_data = send_data
+    finally:
+        com.cleanup()
+
+    print("Synthetic RAW10 frame %dx%d, %d bytes" % (frame.width, frame.height, frame.size))
+    print("%-16s %12s %7s %12s %12s" % ("encoding", "wire bytes", "ratio", "encode ms", "dump ms"))
+    for name, received, dump_time, encode_time in results:
+        print("%-16s %12d %7.3f %12.1f %12.1f" % (name, received, received / results[0][1], encode_time, dump_time))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
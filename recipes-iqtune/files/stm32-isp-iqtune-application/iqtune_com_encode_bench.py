@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2024 STMicroelectronics.
+# All rights reserved.
+#
+# This software is licensed under terms that can be found in the LICENSE file
+# in the root directory of this software component.
+# If no LICENSE file comes with this software, it is provided AS-IS.
+
+"""
+Compare the encoding time of the GET replies by the former bytes concatenation
+and by the precompiled struct layouts of stm32_isp_iqtune_com.py, after checking
+that both give the same bytes.
+"""
+
+import sys
+import types
+import timeit
+import argparse
+from struct import pack
+
+from stm32_isp_iqtune_com import IQTuneCom, CMD_HANDLERS, CmdID, CmdOperation
+
+# Values returned by libcamerasrc for the benchmarked replies
+AWB_ENABLE = 1
+AWB_PROFILE_NAMES = ("Tungsten", "Fluorescent", "Daylight", "Cloudy", "Shade")
+AWB_COLOR_TEMPS = (2856, 4000, 5000, 6500, 7500)
+AWB_ISP_GAINS = tuple(100000000 + 1000 * index for index in range(15))
+AWB_CCMS = tuple((-1) ** index * 10000000 * index for index in range(45))
+STATISTIC_AVERAGES = (32, 64, 48)
+STATISTIC_BINS = tuple(1000 * index for index in range(12))
+
+def old_awb_algo():
+    """
+    former encoding of the GET CMD_AWBALGO reply
+    """
+    cmd = CmdID.CMD_AWBALGO.value
+    read_values = pack('B', AWB_ENABLE)
+    for val in AWB_PROFILE_NAMES:
+        read_values = read_values + val.encode('utf-8') + b'\x00' * (32 - len(val)) # 32 bytes aligned
+    read_values = read_values + b'\x00' * 3 # padding to keep c-type structure aligned
+    for val in AWB_COLOR_TEMPS:
+        read_values = read_values + pack('<I', val)
+    for val in AWB_ISP_GAINS:
+        read_values = read_values + pack('<I', val)
+    for val in AWB_CCMS:
+        read_values = read_values + pack('<i', val)
+    return bytes([CmdOperation.CMD_OP_GET_OK.value, cmd, 0, 0]) + read_values
+
+def old_statistic_up():
+    """
+    former encoding of the GET CMD_STATISTICUP reply
+    """
+    cmd = CmdID.CMD_STATISTICUP.value
+    read_values = b''
+    for val in STATISTIC_AVERAGES:
+        read_values = read_values + pack('B', val)
+    for val in STATISTIC_BINS:
+        read_values = read_values + pack('<I', val)
+    return bytes([CmdOperation.CMD_OP_GET_OK.value, cmd, 0, 0]) + read_values
+
+def main():
+    parser = argparse.ArgumentParser(description="IQTune GET reply encoding benchmark")
+    parser.add_argument("--count", type=int, default=100000,
+                        help="number of encodings of each reply")
+    args = parser.parse_args()
+
+    # only the transmission buffer of the command server is used by the encoder
+    com = types.SimpleNamespace(_tx_buffer=bytearray())
+    awb_handler = CMD_HANDLERS[CmdID.CMD_AWBALGO.value]
+    statistic_handler = CMD_HANDLERS[CmdID.CMD_STATISTICUP.value]
+
+    def new_awb_algo():
+        values = (AWB_ENABLE, *[val.encode('utf-8') for val in AWB_PROFILE_NAMES],
+                  *AWB_COLOR_TEMPS, *AWB_ISP_GAINS, *AWB_CCMS)
+        return IQTuneCom._encode_reply(com, awb_handler.reply_layout(), awb_handler.cmd, values)
+
+    def new_statistic_up():
+        layout = statistic_handler.reply_layout(len(STATISTIC_AVERAGES), len(STATISTIC_BINS))
+        return IQTuneCom._encode_reply(com, layout, statistic_handler.cmd,
+                                       (*STATISTIC_AVERAGES, *STATISTIC_BINS))
+
+    ret = 0
+    for name, old, new in (("CMD_AWBALGO", old_awb_algo, new_awb_algo),
+                           ("CMD_STATISTICUP", old_statistic_up, new_statistic_up)):
+        if bytes(new()) != old():
+            print("FAIL: %s replies differ" % name)
+            ret = 1
+            continue
+        old_time = min(timeit.repeat(old, number=args.count, repeat=5)) / args.count * 1e6
+        new_time = min(timeit.repeat(new, number=args.count, repeat=5)) / args.count * 1e6
+        print("%s (%d bytes): %.2f us before, %.2f us after, x%.1f"
+              % (name, len(old()), old_time, new_time, old_time / new_time))
+    return ret
+
+if __name__ == '__main__':
+    sys.exit(main())
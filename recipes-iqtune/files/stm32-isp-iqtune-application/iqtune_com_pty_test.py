@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2024 STMicroelectronics.
+# All rights reserved.
+#
+# This software is licensed under terms that can be found in the LICENSE file
+# in the root directory of this software component.
+# If no LICENSE file comes with this software, it is provided AS-IS.
+
+"""
+Measure the idle CPU load and the command round-trip latency of the IQTune
+serial link through a pseudo terminal acting as the USB ACM port.
+
+By default the command server of stm32_isp_iqtune_com.py is run in this process
+with a simulated pipeline. With --app, the whole application is started on the
+pseudo terminal and its own CPU load is measured, GTK main loop included.
+"""
+
+import os
+import sys
+import tty
+import time
+import select
+import struct
+import argparse
+import subprocess
+import contextlib
+import types
+
+from stm32_isp_iqtune_com import IQTuneCom, SerialTransport, CmdID, CmdOperation
+
+# Reply of GET CMD_SENSORGAIN: header and gain in mdB
+SENSOR_GAIN_REPLY = struct.Struct('<4BI')
+
+class FakePipeline():
+    """
+    Minimal pipeline answering the property accesses of the command server
+    """
+    def __init__(self):
+        self.frame_sequence = 0
+        self.properties = {'sensor-gain': 1.0}
+
+    def wait_frame_sequence(self, sequence, timeout):
+        return True
+
+    def get_libcamera_property(self, property):
+        return self.properties[property]
+
+    def set_libcamera_property(self, property, value):
+        self.properties[property] = value
+
+    def transaction(self):
+        return contextlib.nullcontext()
+
+def cpu_time(pid):
+    """
+    return the user and system CPU time consumed by a process, in seconds
+    """
+    with open("/proc/%d/stat" % pid) as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def measure_idle_cpu(pid, duration):
+    """
+    return the CPU load of a process in percent of one core while no command is sent
+    """
+    start_cpu, start = cpu_time(pid), time.monotonic()
+    time.sleep(duration)
+    return 100 * (cpu_time(pid) - start_cpu) / (time.monotonic() - start)
+
+def read_exactly(fd, size, timeout):
+    data = bytearray()
+    deadline = time.monotonic() + timeout
+    while len(data) < size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            raise TimeoutError("no reply after %d bytes" % len(data))
+        data += os.read(fd, size - len(data))
+    return bytes(data)
+
+def measure_latency(fd, count, timeout):
+    """
+    send GET CMD_SENSORGAIN commands one after the other and return the round-trip
+    durations in ms
+    """
+    request = bytes([CmdOperation.CMD_OP_GET.value, CmdID.CMD_SENSORGAIN.value, 0, 0])
+    durations = []
+    for _ in range(count):
+        start = time.monotonic()
+        os.write(fd, request)
+        reply = SENSOR_GAIN_REPLY.unpack(read_exactly(fd, SENSOR_GAIN_REPLY.size, timeout))
+        durations.append((time.monotonic() - start) * 1000)
+        if reply[0] != CmdOperation.CMD_OP_GET_OK.value:
+            raise RuntimeError("GET CMD_SENSORGAIN failed")
+    return sorted(durations)
+
+def wait_ready(fd, timeout):
+    """
+    send GET CMD_SENSORGAIN until the command server answers: the commands sent
+    before the com port is opened are flushed
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            measure_latency(fd, 1, 0.2)
+            break
+        except TimeoutError:
+            if time.monotonic() > deadline:
+                raise
+    # drop the late replies of the previous attempts
+    while select.select([fd], [], [], 0.2)[0]:
+        os.read(fd, 4096)
+
+def main():
+    parser = argparse.ArgumentParser(description="IQTune serial link idle CPU and latency test")
+    parser.add_argument("--app", action="store_true",
+                        help="run the whole application on the pseudo terminal (needs the camera)")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="duration of the idle CPU measure in seconds")
+    parser.add_argument("--count", type=int, default=200,
+                        help="number of commands of the latency measure")
+    parser.add_argument("--max-idle-cpu", type=float, default=2.0,
+                        help="maximum idle CPU load accepted, in percent of one core")
+    args = parser.parse_args()
+
+    # the application side opens the slave end as its com port, the test is the host
+    host_fd, device_fd = os.openpty()
+    tty.setraw(host_fd)
+    tty.setraw(device_fd)
+    port = os.ttyname(device_fd)
+
+    if args.app:
+        app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stm32_isp_iqtune_app.py")
+        process = subprocess.Popen([sys.executable, app_path, "--transport", "serial:" + port])
+        pid = process.pid
+        startup_timeout = 30.0
+    else:
+        app = types.SimpleNamespace(gst_widget=FakePipeline(), startup_phase=lambda phase: None)
+        com = IQTuneCom(app, SerialTransport(port))
+        com.start()
+        pid = os.getpid()
+        startup_timeout = 5.0
+
+    try:
+        # the first reply tells that the command server is ready
+        wait_ready(host_fd, startup_timeout)
+        idle_cpu = measure_idle_cpu(pid, args.duration)
+        durations = measure_latency(host_fd, args.count, 1.0)
+    finally:
+        if args.app:
+            process.terminate()
+            process.wait()
+        else:
+            com.cleanup()
+
+    print("Idle CPU load: %.2f %%" % idle_cpu)
+    print("Round-trip latency: mean %.3f ms, median %.3f ms, p99 %.3f ms, max %.3f ms"
+          % (sum(durations) / len(durations), durations[len(durations) // 2],
+             durations[int(len(durations) * 0.99)], durations[-1]))
+    if idle_cpu > args.max_idle_cpu:
+        print("FAIL: idle CPU load above %.2f %%" % args.max_idle_cpu)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,12 +7,20 @@
 # in the root directory of this software component.
 # If no LICENSE file comes with this software, it is provided AS-IS.
 
-import serial
-import ctypes
 import time
 import subprocess
 import threading
-from struct import pack, unpack
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+import zlib
+import itertools
+import os
+import socket
+import fcntl
+import termios
+from struct import Struct
 from enum import Enum
 
 class CmdOperation(Enum):
@@ -50,34 +58,715 @@ class CmdID(Enum):
   CMD_GAMMA               = 0x17
   CMD_SENSORINFO          = 0x18
   CMD_SENSORTESTPATTERN   = 0x19
+  CMD_CAPABILITIES        = 0x1A
+  CMD_DUMP_ENCODING       = 0x1B
+  CMD_DUMP_RESEND         = 0x1C
+  CMD_DUMP_RAW_BURST      = 0x1D
+  CMD_PIPELINING          = 0x1E
+  CMD_STATS_SUBSCRIBE     = 0x1F
+  CMD_STATS_HISTORY       = 0x20
+  CMD_BATCH               = 0x21
 #Application API commands for test purpose
   CMD_USER_EXPOSURETARGET = 0x80
   CMD_USER_LISTWBREFMODES = 0x81
   CMD_USER_WBREFMODE      = 0x82
 
-class IQTuneCom():
+class CmdCapability(Enum):
+  CMD_CAP_DUMP_ENCODING   = 0x01
+  CMD_CAP_DUMP_RAW_BURST  = 0x02
+  CMD_CAP_PIPELINING      = 0x04
+  CMD_CAP_STATS_SUBSCRIBE = 0x08
+  CMD_CAP_STATS_HISTORY   = 0x10
+  CMD_CAP_BATCH           = 0x20
+
+class BurstMode(Enum):
+  BURST_MODE_FRAMES       = 0x00
+  BURST_MODE_STATISTICS   = 0x01
+
+class StatisticProfile(Enum):
+  STATISTIC_PROFILE_FULL          = 0x00
+  STATISTIC_PROFILE_AVERAGE_UP    = 0x01
+  STATISTIC_PROFILE_AVERAGE_DOWN  = 0x02
+
+class DumpEncoding(Enum):
+  DUMP_ENCODING_NONE          = 0x00
+  DUMP_ENCODING_ZLIB          = 0x01
+  DUMP_ENCODING_RAW10_PACKED  = 0x02
+  DUMP_ENCODING_CHUNKED_CRC   = 0x04
+
+# Size of the command header: operation, command ID and 2 padding bytes added
+# by the ctype structure alignment
+CMD_HEADER_SIZE = 4
+
+# Delay before trying to reopen the com port after a serial error
+CMD_REOPEN_DELAY = 1.0
+
+# Maximum duration to wait for the command server thread to stop
+CMD_SERVER_STOP_TIMEOUT = 2.0
+
+# Number of frames to wait after a SET command before the new settings are
+# considered applied by the pipeline, and maximum duration of this wait. The
+# statistics of a new area are computed over several frames: the former 0.8 s
+# delay is kept as a frame count at the 30 fps of the sensors, and the timeout
+# covers this count down to 15 fps.
+CMD_SETTLE_FRAMES = 3
+CMD_SETTLE_FRAMES_STATISTICAREA = 24
+CMD_SETTLE_TIMEOUT = 2.0
+
+# Delay without statistics reader after which the statistic profile is reverted
+# to the average down one, so that the algorithms are not slowed down anymore
+CMD_STATS_REVERT_DELAY = 1.5
+
+# Layout of the statistic packets pushed to the subscribed host: frame sequence
+# number, flags, number of averages (up then down) and of histogram bins (up then
+# down). The averages follow as uint32, then the bins as uint32, or as int16
+# differences with the bins of the previous packet when flagged as delta encoded.
+STATS_PACKET_HEADER_LAYOUT = Struct('<4BIBBBx')
+STATS_PACKET_DELTA = 0x01
+
+# Number of frames kept by the statistics history, about 34 s at 30 fps
+STATS_HISTORY_SIZE = 1024
+
+# Layout of the statistics history request: time range of the samples to read, in
+# ms since the history start, the last time being 0 for the latest sample.
+STATS_HISTORY_REQUEST_LAYOUT = Struct('<II')
+
+# Layout of the statistics history reply: number of samples, size of a sample and
+# number of averages up then down. The samples follow as one block, each made
+# of the frame sequence number (uint32), the sampling time in ms since the history
+# start (uint32), the averages up then down (uint8), the sensor gain in mdB (int32),
+# the sensor exposure (uint32), the AWB profile color temperature (uint32) and the
+# AWB profile name (32 bytes).
+STATS_HISTORY_HEADER_LAYOUT = Struct('<4BIHBB')
+
+# Maximum duration to wait for a frame to be dumped by the pipeline
+CMD_DUMP_TIMEOUT = 2.0
+
+# Additional duration to wait for each frame of a raw burst
+CMD_BURST_FRAME_TIMEOUT = 0.1
+
+# Size of the chunks used to write a dumped frame on the com port
+CMD_DUMP_CHUNK_SIZE = 65536
+
+# Address listened by the TCP transport when no host is given: the IQTune
+# protocol is not authenticated, it is only exposed wider on explicit request
+CMD_TCP_DEFAULT_HOST = '127.0.0.1'
+
+# Default serial com port exposed by the USB ACM gadget
+CMD_SERIAL_PORT = '/dev/ttyGS0'
+CMD_SERIAL_BAUDRATE = 115200
+
+# Size of the reception ring buffer, large enough to hold several commands
+CMD_RX_BUFFER_SIZE = 4096
+
+# Layout of the batch command: length of the payload following, made of the SET and
+# GET command frames to process in order. The reply gives the number of entries,
+# then the answer of each command prefixed by its length.
+CMD_BATCH_LENGTH_LAYOUT = Struct('<I')
+CMD_BATCH_REPLY_HEADER_LAYOUT = Struct('<4BI')
+CMD_BATCH_ENTRY_LAYOUT = Struct('<I')
+
+# Layout of the frame prefixing every message sent to the host once pipelining is
+# enabled: request ID (the 2 padding bytes of the command answered) and length
+CMD_PIPELINE_FRAME_LAYOUT = Struct('<HI')
+
+# Layout of the dump reply header: size, width, height, pitch and format of the frame.
+# The hosts having negotiated a dump encoding get the encoding applied as well.
+DUMP_HEADER_LAYOUT = Struct('<4B5I')
+DUMP_ENCODED_HEADER_LAYOUT = Struct('<4B6I')
+
+# Layout of the raw burst reply header: number of frames, mode, size of each payload,
+# width, height, pitch and format of the frames, and encoding applied
+DUMP_BURST_HEADER_LAYOUT = Struct('<4B8I')
+
+# Layout of the header of a resent dump: ID of the dump command
+DUMP_RESEND_HEADER_LAYOUT = Struct('<4BI')
+
+# Layout of the length prefixing each compressed chunk of a zlib encoded dump
+DUMP_CHUNK_LAYOUT = Struct('<I')
+
+# Layout of the header prefixing each chunk of a dump with CRC: sequence number,
+# length and CRC32 of the chunk
+DUMP_CRC_CHUNK_LAYOUT = Struct('<III')
+
+DUMP_SUPPORTED_ENCODINGS = DumpEncoding.DUMP_ENCODING_ZLIB.value | DumpEncoding.DUMP_ENCODING_RAW10_PACKED.value \
+                         | DumpEncoding.DUMP_ENCODING_CHUNKED_CRC.value
+
+# Compression level favouring speed over ratio
+DUMP_ZLIB_LEVEL = 1
+
+def pack_raw10(data, width, height, pitch):
     """
-    Class that handles communication between the application and the host computer
+    pack a RAW10 frame stored in 16 bits containers into the MIPI CSI-2 RAW10 format:
+    the 8 most significant bits of 4 pixels followed by a byte of their 2 least
+    significant bits
     """
-    def __init__(self, app):
-        self._app = app
-        self._comport = '/dev/ttyGS0'
-        self._baudrate = 115200
+    # numpy and pyserial are loaded on first use so that this module is quickly
+    # imported, and can be imported without them
+    import numpy as np
+    pixels = np.frombuffer(data, dtype='<u2', count=height * pitch // 2).reshape(height, pitch // 2)[:, :width]
+    pixels = pixels.reshape(height, width // 4, 4)
+    packed = np.empty((height, width // 4, 5), dtype=np.uint8)
+    packed[..., :4] = pixels >> 2
+    packed[..., 4] = (pixels[..., 0] & 0x3) | ((pixels[..., 1] & 0x3) << 2) \
+                   | ((pixels[..., 2] & 0x3) << 4) | ((pixels[..., 3] & 0x3) << 6)
+    return packed
+
+def bayer_statistics(frames, width):
+    """
+    compute the temporal mean and variance of each pixel of a burst of RAW frames
+    stored in 16 bits containers. The result is split per Bayer channel: 2 sets
+    (mean, variance) of 4 float32 planes of half resolution, in the order of the
+    pixels of the 2x2 Bayer block.
+    """
+    import numpy as np
+    nb_frames, height = frames.shape[:2]
+    total = np.zeros((height, width), dtype=np.uint32)
+    total_sq = np.zeros((height, width), dtype=np.uint64)
+    for frame in frames:
+        pixels = frame[:, :width].astype(np.uint32)
+        total += pixels
+        total_sq += pixels * pixels
+    mean = total / nb_frames
+    variance = total_sq / nb_frames - mean * mean
+    stats = np.empty((2, 4, height // 2, width // 2), dtype=np.float32)
+    for index, plane in enumerate((mean, variance)):
+        stats[index, 0] = plane[0::2, 0::2]
+        stats[index, 1] = plane[0::2, 1::2]
+        stats[index, 2] = plane[1::2, 0::2]
+        stats[index, 3] = plane[1::2, 1::2]
+    return stats
+
+class CmdHandler():
+    """
+    Class that describes how a command is handled: the IQTuneCom methods processing
+    the SET and GET requests, the layout of the SET payload (header excluded), the
+    layout of the GET reply (header included) and the libcamerasrc properties accessed.
+    The GET replies with a variable number of values are described by a format
+    completed with the number of values. The GET requests of variable size carry
+    the length of their payload after the header, described by a length layout.
+    """
+    def __init__(self, cmd_id, set_config=None, get_config=None, set_layout=None,
+                 get_layout=None, get_format=None, get_request_layout=None,
+                 get_length_layout=None, properties=(),
+                 settle_frames=CMD_SETTLE_FRAMES, background=False):
+        self.cmd_id = cmd_id
+        self.cmd = cmd_id.value
+        self.set_config = set_config
+        self.get_config = get_config
+        self.set_layout = set_layout
+        self.get_layout = get_layout
+        self.get_format = get_format
+        self.get_request_layout = get_request_layout
+        self.get_length_layout = get_length_layout
+        self.properties = properties
+        self.settle_frames = settle_frames
+        # the GET commands streaming a dump are run in background when pipelining
+        # is enabled, so that the next commands are answered meanwhile
+        self.background = background
+        self._variable_layouts = {}
+
+    def set_frame_size(self):
+        """
+        return the size of the SET command frame (header included), None if the
+        command cannot be set
+        """
+        if self.set_layout is None:
+            return None
+        return CMD_HEADER_SIZE + self.set_layout.size
+
+    def get_frame_size(self, length=0):
+        """
+        return the size of the GET command frame (header included), given the
+        payload length of the requests of variable size
+        """
+        if self.get_length_layout is not None:
+            return CMD_HEADER_SIZE + self.get_length_layout.size + length
+        if self.get_request_layout is None:
+            return CMD_HEADER_SIZE
+        return CMD_HEADER_SIZE + self.get_request_layout.size
+
+    def reply_layout(self, *counts):
+        """
+        return the layout of the GET reply, the layout of the replies with a variable
+        number of values is built once for each number of values
+        """
+        if self.get_layout is not None:
+            return self.get_layout
+        layout = self._variable_layouts.get(counts)
+        if layout is None:
+            layout = Struct(self.get_format % counts)
+            self._variable_layouts[counts] = layout
+        return layout
+
+class CmdFrameDecoder():
+    """
+    Class that rebuilds the commands sent by the host computer from the serial
+    byte stream. The received bytes are stored in a ring buffer so that a command
+    split across several reads is reassembled and several commands received in a
+    single read are all returned.
+    """
+    def __init__(self, size=CMD_RX_BUFFER_SIZE):
+        self._size = size
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        # scratch buffer used to return a contiguous frame wrapping around the ring end
+        self._frame = bytearray()
+        self._start = 0
+        self._count = 0
+        # bytes of an oversized command still to be discarded as they are received
+        self._discard = 0
+
+    def free_space(self):
+        return self._size - self._count
+
+    def reception_view(self):
+        """
+        return the contiguous free area of the ring buffer where new data can be read
+        """
+        end = (self._start + self._count) % self._size
+        if end >= self._start and self._count < self._size:
+            return self._view[end:self._size]
+        return self._view[end:self._start]
+
+    def commit(self, nb_bytes):
+        """
+        account for nb_bytes written into the area returned by reception_view
+        """
+        self._count += nb_bytes
+
+    def feed(self, data):
+        """
+        copy the data into the ring buffer, return the number of bytes stored
+        """
+        data = memoryview(data)
+        stored = 0
+        while stored < len(data) and self.free_space():
+            view = self.reception_view()
+            nb_bytes = min(len(view), len(data) - stored)
+            view[:nb_bytes] = data[stored:stored + nb_bytes]
+            self.commit(nb_bytes)
+            stored += nb_bytes
+        return stored
+
+    def _peek(self, offset):
+        return self._buf[(self._start + offset) % self._size]
+
+    def _peek_bytes(self, offset, size):
+        return bytes(self._peek(offset + index) for index in range(size))
+
+    def _frame_size(self):
+        """
+        return the size of the frame at the head of the ring buffer, 0 if the
+        frame is not complete yet and -1 if the head byte is not a valid operation
+        """
+        if self._count < 2:
+            return 0
+        operation = self._peek(0)
+        if operation == CmdOperation.CMD_OP_GET.value:
+            handler = CMD_HANDLERS.get(self._peek(1))
+            if handler is None:
+                size = CMD_HEADER_SIZE
+            elif handler.get_length_layout is not None:
+                length_layout = handler.get_length_layout
+                if self._count < CMD_HEADER_SIZE + length_layout.size:
+                    return 0
+                size = handler.get_frame_size(*length_layout.unpack(self._peek_bytes(CMD_HEADER_SIZE,
+                                                                                      length_layout.size)))
+                if size > self._size:
+                    # the command can never be received whole: only its header and
+                    # length are returned, so that it is answered by a failure, and
+                    # its payload is discarded without being decoded
+                    prefix = CMD_HEADER_SIZE + length_layout.size
+                    self._discard = size - prefix
+                    return prefix
+            else:
+                size = handler.get_frame_size()
+        elif operation == CmdOperation.CMD_OP_SET.value:
+            handler = CMD_HANDLERS.get(self._peek(1))
+            size = handler.set_frame_size() if handler is not None else None
+            if size is None:
+                # unknown command: its size is not known, only its header is returned
+                # so that it is answered by a failure
+                size = CMD_HEADER_SIZE
+        else:
+            return -1
+        if size > self._count:
+            return 0
+        return size
+
+    def _consume(self, size):
+        """
+        return a view on the size bytes at the head of the ring buffer and release them
+        """
+        start = self._start
+        self._start = (start + size) % self._size
+        self._count -= size
+        if self._count == 0:
+            self._start = 0
+        if start + size <= self._size:
+            return self._view[start:start + size]
+        # the frame wraps around the end of the ring buffer
+        if size > len(self._frame):
+            self._frame = bytearray(size)
+        first = self._size - start
+        self._frame[:first] = self._view[start:self._size]
+        self._frame[first:size] = self._view[0:size - first]
+        return memoryview(self._frame)[:size]
+
+    def frames(self):
+        """
+        generator returning all the complete frames stored in the ring buffer
+        """
+        while True:
+            if self._discard:
+                nb_bytes = min(self._discard, self._count)
+                self._consume(nb_bytes)
+                self._discard -= nb_bytes
+                if self._discard:
+                    return
+            size = self._frame_size()
+            if size == 0:
+                return
+            if size < 0:
+                # not the start of a command: skip the byte to resynchronize
+                print("Invalid command operation (" + str(self._peek(0)) + ") dropped")
+                self._consume(1)
+                continue
+            yield self._consume(size)
+
+class CmdTransport(ABC):
+    """
+    Base class of the links carrying the IQTune protocol. The link is opened on
+    demand, its file descriptor is watched by the command server loop, and the
+    pending bytes are read directly into the reception buffer.
+    """
+    # the USB gadget is switched to ACM serial only for the transports needing it
+    needs_serial_gadget = False
+    # the protocol state negotiated by the host lasts as long as its connection, the
+    # serial host is not notified when the port is reopened and keeps its state
+    session_per_connection = False
+
+    @abstractmethod
+    def open(self):
+        pass
+
+    @abstractmethod
+    def is_open(self):
+        pass
+
+    @abstractmethod
+    def fileno(self):
+        pass
+
+    def accept(self):
+        """
+        accept a pending host connection, return True if the watched file descriptor changed
+        """
+        return False
+
+    @abstractmethod
+    def in_waiting(self):
+        pass
+
+    @abstractmethod
+    def readinto(self, view):
+        pass
+
+    @abstractmethod
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+class SerialTransport(CmdTransport):
+    """
+    IQTune protocol over the USB ACM serial gadget, or another serial port
+    """
+    def __init__(self, comport=CMD_SERIAL_PORT, baudrate=CMD_SERIAL_BAUDRATE):
+        # the USB gadget is switched only for the port it exposes
+        self.needs_serial_gadget = comport == CMD_SERIAL_PORT
+        self._comport = comport
+        self._baudrate = baudrate
         self._ser = None
 
-        # Disable ethernet usb gadget
-        cmd = 'su -c "stm32_usbotg_eth_config.sh stop"'
-        ret = subprocess.run(cmd, shell=True)
-        if ret.returncode != 0:
-            print("Fail to disable ethernet usb gadget")
-        # Enable serial usb gadget for USB serial communication
-        cmd = 'su -c "stm32_usbotg_acm_config.sh start"'
-        ret = subprocess.run(cmd, shell=True)
-        if ret.returncode != 0:
-            print("Fail to enable selrial usb gadget")
+    def __str__(self):
+        return self._comport
+
+    def open(self):
+        import serial
+        self._ser = serial.Serial(self._comport, self._baudrate)
+
+    def is_open(self):
+        return self._ser is not None and self._ser.is_open
+
+    def fileno(self):
+        return self._ser.fileno()
+
+    def in_waiting(self):
+        return self._ser.in_waiting
+
+    def readinto(self, view):
+        return self._ser.readinto(view)
+
+    def write(self, data):
+        self._ser.write(data)
+
+    def flush(self):
+        self._ser.flush()
+
+    def close(self):
+        if self._ser is not None:
+            self._ser.close()
+            self._ser = None
+
+class SocketTransport(CmdTransport):
+    """
+    IQTune protocol over a TCP or UNIX stream socket: one host connection at a
+    time is served, the USB ethernet gadget can be used for a higher bandwidth
+    """
+    session_per_connection = True
+
+    def __init__(self, address):
+        # a (host, port) tuple for TCP, a path for UNIX
+        self._address = address
+        self._listener = None
+        self._conn = None
+
+    def __str__(self):
+        if isinstance(self._address, tuple):
+            return "tcp:%s:%d" % self._address
+        return "unix:" + self._address
+
+    def open(self):
+        if isinstance(self._address, tuple):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            if os.path.exists(self._address):
+                os.unlink(self._address)
+        try:
+            listener.bind(self._address)
+            listener.listen(1)
+        except OSError:
+            listener.close()
+            raise
+        self._listener = listener
+
+    def is_open(self):
+        return self._listener is not None
+
+    def fileno(self):
+        return self._conn.fileno() if self._conn is not None else self._listener.fileno()
+
+    def accept(self):
+        if self._conn is not None:
+            return False
+        self._conn, address = self._listener.accept()
+        if self._conn.family == socket.AF_INET:
+            self._conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        print("IQTune host connected", address)
+        return True
+
+    def in_waiting(self):
+        pending = fcntl.ioctl(self._conn.fileno(), termios.FIONREAD, b'\0\0\0\0')
+        nb_bytes = int.from_bytes(pending, 'little')
+        if nb_bytes == 0:
+            # readable without pending bytes: the host closed the connection
+            raise ConnectionError("IQTune host disconnected")
+        return nb_bytes
+
+    def readinto(self, view):
+        return self._conn.recv_into(view)
+
+    def write(self, data):
+        self._conn.sendall(data)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+def make_transport(spec):
+    """
+    create the transport described by 'serial[:PORT]', 'tcp:[HOST:]PORT' or 'unix:PATH',
+    the TCP transport listens on the loopback interface unless a host is given
+    """
+    kind, _, address = spec.partition(':')
+    if kind == 'serial':
+        return SerialTransport(address or CMD_SERIAL_PORT)
+    if kind == 'tcp':
+        host, _, port = address.rpartition(':')
+        return SocketTransport((host or CMD_TCP_DEFAULT_HOST, int(port)))
+    if kind == 'unix' and address:
+        return SocketTransport(address)
+    raise ValueError("Unknown IQTune transport: " + spec)
+
+class StatsSession():
+    """
+    Class that keeps the full statistic profile applied while the statistics are
+    read: each reader holds a reference, and a single revert timer restores the
+    average down profile once no reference has been held for CMD_STATS_REVERT_DELAY.
+    It is used from the command server loop.
+    """
+    def __init__(self, com):
+        self._com = com
+        self._refcount = 0
+        self._full = False
+        self._revert_handle = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def acquire(self):
+        self._refcount += 1
+        if self._revert_handle is not None:
+            self._revert_handle.cancel()
+            self._revert_handle = None
+        if not self._full:
+            self._full = True
+            self._com._set_statistic_profile(StatisticProfile.STATISTIC_PROFILE_FULL)
+
+    def release(self):
+        self._refcount -= 1
+        if self._refcount == 0:
+            # every new reader within the delay postpones the revert
+            self._revert_handle = self._com._loop.call_later(CMD_STATS_REVERT_DELAY, self._revert)
+
+    def cancel(self):
+        if self._revert_handle is not None:
+            self._revert_handle.cancel()
+            self._revert_handle = None
+
+    def _revert(self):
+        self._revert_handle = None
+        if self._refcount == 0 and self._full:
+            self._full = False
+            self._com._set_statistic_profile(StatisticProfile.STATISTIC_PROFILE_AVERAGE_DOWN)
+
+class StatsHistory():
+    """
+    Class that keeps the statistics and sensor settings of the last frames in a
+    fixed size ring buffer of packed records, so that the convergence of the AEC
+    and AWB algorithms can be read afterwards by the host.
+    """
+    def __init__(self, size=STATS_HISTORY_SIZE):
+        self._size = size
+        self._samples = None
+        self._count = 0
+        self._start_time = 0
+
+    def reset(self):
+        self._count = 0
+        self._start_time = time.monotonic()
+
+    def append(self, sequence, timestamp, averages_up, averages_down, gain, exposure,
+               profile_name, color_temp):
+        import numpy as np
+        if self._samples is None or self.nb_averages() != (len(averages_up), len(averages_down)):
+            # the record layout depends on the number of averages given by the ISP
+            dtype = np.dtype([('sequence', '<u4'), ('time', '<u4'),
+                              ('averages_up', 'u1', (len(averages_up),)),
+                              ('averages_down', 'u1', (len(averages_down),)),
+                              ('gain', '<i4'), ('exposure', '<u4'), ('color_temp', '<u4'),
+                              ('profile_name', 'S32')])
+            self._samples = np.zeros(self._size, dtype=dtype)
+            self._count = 0
+        sample = self._samples[self._count % self._size]
+        sample['sequence'] = sequence
+        sample['time'] = int((timestamp - self._start_time) * 1000)
+        sample['averages_up'] = averages_up
+        sample['averages_down'] = averages_down
+        sample['gain'] = gain
+        sample['exposure'] = exposure
+        sample['color_temp'] = color_temp
+        sample['profile_name'] = profile_name
+        self._count += 1
+
+    def nb_averages(self):
+        """
+        return the number of averages up and down of the samples
+        """
+        return (self._samples.dtype['averages_up'].shape[0], self._samples.dtype['averages_down'].shape[0])
+
+    def select(self, first, last):
+        """
+        return the samples taken from the time first to last included, in ms since
+        the history start, oldest first
+        """
+        if self._samples is None or self._count == 0:
+            return None
+        import numpy as np
+        if self._count <= self._size:
+            samples = self._samples[:self._count]
+        else:
+            samples = np.roll(self._samples, -(self._count % self._size))
+        times = samples['time']
+        return samples[(times >= first) & (times <= last)]
+
+class IQTuneCom():
+    """
+    Class that handles communication between the application and the host computer.
+    The commands are served by an asyncio loop running in its own thread, the dumps
+    of the hosts having enabled pipelining are streamed from a background worker.
+    """
+    def __init__(self, app, transport=None):
+        self._app = app
+        self._transport = transport if transport is not None else SerialTransport()
+        self._loop = None
+        self._server_thread = None
+        self._server_lock = threading.Lock()
+        self._reader_fd = None
+        self._reopen_handle = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._tx_lock = threading.RLock()
+        self._pipelining = False
+        self._request = threading.local()
+        self._settle_sequence = 0
+        self._stats_session = StatsSession(self)
+        self._stats_interval = 0
+        self._stats_request_id = 0
+        self._stats_push_pending = False
+        self._stats_bins = None
+        self._stats_layouts = {}
+        self._stats_history = StatsHistory()
+        self._stats_history_enabled = False
+        self._stats_sample_pending = False
+        self._dump_encoding = DumpEncoding.DUMP_ENCODING_NONE.value
+        self._dump_encoding_negotiated = False
+        self._dump_cache = None
+        self._tx_buffer = bytearray(max(handler.get_layout.size for handler in CMD_HANDLERS.values()
+                                        if handler.get_layout is not None))
+        self._decoder = CmdFrameDecoder()
+        self._start_requested = False
+
+        # the usb gadget is switched in background while the preview starts
+        self._gadget_ready = threading.Event()
+        self._gadget_thread = None
+        if self._transport.needs_serial_gadget:
+            self._gadget_thread = threading.Thread(target=self._enable_serial_gadget, daemon=True)
+            self._gadget_thread.start()
+        else:
+            self._gadget_ready.set()
 
     def __del__(self):
         self._close()
+        if self._gadget_thread is None:
+            return
+        self._gadget_thread.join()
         # Disable serial usb gadget
         cmd = 'su -c "stm32_usbotg_acm_config.sh stop"'
         test = subprocess.run(cmd, shell=True)
@@ -89,224 +778,808 @@ class IQTuneCom():
         if test.returncode != 0:
             print("Fail to restore ethernet usb gadget")
 
+    def _enable_serial_gadget(self):
+        # Disable ethernet usb gadget
+        cmd = 'su -c "stm32_usbotg_eth_config.sh stop"'
+        ret = subprocess.run(cmd, shell=True)
+        if ret.returncode != 0:
+            print("Fail to disable ethernet usb gadget")
+        # Enable serial usb gadget for USB serial communication
+        cmd = 'su -c "stm32_usbotg_acm_config.sh start"'
+        ret = subprocess.run(cmd, shell=True)
+        if ret.returncode != 0:
+            print("Fail to enable selrial usb gadget")
+        self._app.startup_phase("usb serial gadget enabled")
+        self._gadget_ready.set()
+        # start serving if the start has been requested before the gadget was ready
+        if self._start_requested:
+            self._start_server()
+
+    def _start_server(self):
+        with self._server_lock:
+            if self._server_thread is None:
+                self._server_thread = threading.Thread(target=self._run_server, daemon=True)
+                self._server_thread.start()
+
+    def _run_server(self):
+        """
+        command server thread: open the com port and serve the commands from its own loop
+        """
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(self._reopen_cb, True)
+        self._loop.run_forever()
+        self._loop.close()
+
+    def _stop_server(self):
+        self._reset_session()
+        self._close()
+        self._stats_session.cancel()
+        if self._reopen_handle is not None:
+            self._reopen_handle.cancel()
+            self._reopen_handle = None
+        self._loop.stop()
+
     def _open(self):
-        if self._ser is None or not self._ser.is_open:
-            self._ser = serial.Serial(self._comport, self._baudrate)
+        if not self._transport.is_open():
+            self._transport.open()
+            self._add_reader()
+
+    def _add_reader(self):
+        # the server loop wakes up only when data is received
+        self._reader_fd = self._transport.fileno()
+        self._loop.add_reader(self._reader_fd, self._com_event_cb)
+
+    def _remove_reader(self):
+        if self._reader_fd is not None:
+            self._loop.remove_reader(self._reader_fd)
+            self._reader_fd = None
+
+    def _reset_session(self):
+        """
+        restore the protocol state negotiated by the host to its defaults, so that
+        the next host connected starts with the legacy protocol
+        """
+        self._set_stats_subscription((0,))
+        self._set_stats_history((0,))
+        self._pipelining = False
+        self._dump_encoding = DumpEncoding.DUMP_ENCODING_NONE.value
+        self._dump_encoding_negotiated = False
+        self._dump_cache = None
+        # the partial command of the previous host is dropped
+        self._decoder = CmdFrameDecoder()
 
     def _close(self):
-        if self._ser is not None:
-            self._ser.close()
-            self._ser = None
+        if self._loop is not None and not self._loop.is_closed():
+            self._remove_reader()
+        with self._tx_lock:
+            self._transport.close()
+
+    def _serial_error(self):
+        """
+        close the com port and retry to open it later, from the server loop
+        """
+        if self._loop is None or self._loop.is_closed():
+            return
+        if threading.current_thread() is not self._server_thread:
+            # error detected by the background worker
+            self._loop.call_soon_threadsafe(self._serial_error)
+            return
+        self._close()
+        if self._transport.session_per_connection:
+            # the host has disconnected, the next one starts with the legacy protocol
+            self._reset_session()
+        if self._reopen_handle is None:
+            self._reopen_handle = self._loop.call_later(CMD_REOPEN_DELAY, self._reopen_cb)
+
+    def _reopen_cb(self, first=False):
+        self._reopen_handle = None
+        try:
+            self._open()
+        except Exception as exc:
+            if first:
+                print("Fail to open " + str(self._transport) + ": ", exc)
+            # com port not available yet, retry later
+            self._reopen_handle = self._loop.call_later(CMD_REOPEN_DELAY, self._reopen_cb)
 
     def _get_data(self):
-        self._open()
+        """
+        read the pending bytes directly into the decoder ring buffer, return the
+        number of bytes received
+        """
+        received = 0
         try:
-            nb_bytes = self._ser.in_waiting
-            if nb_bytes > 0:
-                data = self._ser.read(size=nb_bytes)
-                #print("get data nb_bytes=" + str(nb_bytes))
-                #print(data)
-                return data
+            nb_bytes = self._transport.in_waiting()
+            while nb_bytes > 0 and self._decoder.free_space():
+                view = self._decoder.reception_view()
+                nb_read = self._transport.readinto(view[:min(nb_bytes, len(view))])
+                #print("get data nb_bytes=" + str(nb_read))
+                self._decoder.commit(nb_read)
+                received += nb_read
+                nb_bytes -= nb_read
         except:
             # serial error detected
-            if self._ser.is_open:
-                self._close()
-        return
+            self._serial_error()
+        return received
 
-    def _send_data(self, data):
-        self._open()
+    def _send_data(self, data, flush=True):
+        """
+        write data to the host, framed with the ID of the request being answered
+        once pipelining is enabled. The replies and dump chunks are written whole
+        so that they can be interleaved. The answers of the commands of a batch are
+        collected instead, to be sent in a single reply.
+        """
+        replies = getattr(self._request, 'replies', None)
+        if replies is not None:
+            replies.append(bytes(data))
+            return True
         try:
-            #print("send data")
-            #print(data)
-            self._ser.write(data)
-            self._ser.flush()
+            with self._tx_lock:
+                if not self._transport.is_open():
+                    return False
+                #print("send data")
+                #print(data)
+                if self._pipelining:
+                    self._transport.write(CMD_PIPELINE_FRAME_LAYOUT.pack(getattr(self._request, 'id', 0), len(data)))
+                self._transport.write(data)
+                if flush:
+                    self._transport.flush()
         except:
             # serial error detected
-            if self._ser.is_open:
-                self._close()
-        return
-
-    def _update_statistic_profile(self):
-        # this function is called in a thread to update the statistic profile
-        # after a sleep of 1.5 seconds so that the algorithm are not slow down
-        # anymore by the full stats profile.
+            self._serial_error()
+            return False
+        return True
+
+    def _write_chunk(self, encoding, index, chunk):
+        """
+        write a chunk of dumped frame: compressed with zlib and prefixed by its
+        length, or by its sequence number, length and CRC32, as negotiated
+        """
+        if encoding & DumpEncoding.DUMP_ENCODING_ZLIB.value:
+            chunk = zlib.compress(chunk, DUMP_ZLIB_LEVEL)
+        if encoding & DumpEncoding.DUMP_ENCODING_CHUNKED_CRC.value:
+            if not self._send_data(DUMP_CRC_CHUNK_LAYOUT.pack(index, len(chunk), zlib.crc32(chunk)), flush=False):
+                return False
+        elif encoding & DumpEncoding.DUMP_ENCODING_ZLIB.value:
+            if not self._send_data(DUMP_CHUNK_LAYOUT.pack(len(chunk)), flush=False):
+                return False
+        return self._send_data(chunk, flush=False)
+
+    def _write_chunks(self, encoding, data, first=0, count=None):
+        """
+        write the chunks of dumped frame from the first one, all of them if count is None
+        """
+        nb_chunks = (len(data) + CMD_DUMP_CHUNK_SIZE - 1) // CMD_DUMP_CHUNK_SIZE
+        last = nb_chunks if count is None else min(nb_chunks, first + count)
+        for index in range(first, last):
+            offset = index * CMD_DUMP_CHUNK_SIZE
+            if not self._write_chunk(encoding, index, data[offset:offset + CMD_DUMP_CHUNK_SIZE]):
+                return False
+        # an empty chunk ends the frame
+        if encoding & DumpEncoding.DUMP_ENCODING_CHUNKED_CRC.value:
+            return self._send_data(DUMP_CRC_CHUNK_LAYOUT.pack(last, 0, 0), flush=False)
+        if encoding & DumpEncoding.DUMP_ENCODING_ZLIB.value:
+            return self._send_data(DUMP_CHUNK_LAYOUT.pack(0), flush=False)
+        return True
+
+    @contextmanager
+    def _map_dump_payload(self, frame, packed):
+        """
+        give access to the dump payload: the packed frame if any, else the mapped frame
+        """
+        if packed is not None:
+            yield packed
+        else:
+            with frame.map() as data:
+                yield data
+
+    def _send_dump(self, cmd, stream, frame, request_time):
+        """
+        send the dumped frame: the metadata frame information, then the mapped frame
+        buffer written by chunks without intermediate copy, then the trailer.
+        The hosts having negotiated a dump encoding get it in the metadata.
+        """
+        size = frame.size
+        pitch = frame.pitch
+        packed = None
+        encoding = self._dump_encoding & ~DumpEncoding.DUMP_ENCODING_RAW10_PACKED.value
+        # only the 10 bits pixels fit the RAW10 packing, the others are sent unpacked
+        if (self._dump_encoding & DumpEncoding.DUMP_ENCODING_RAW10_PACKED.value) and stream == 'raw' \
+           and self._app.sensor_pixel_depth == 10 and frame.width % 4 == 0:
+            with frame.map() as data:
+                if data is None:
+                    return 1
+                packed = memoryview(pack_raw10(data, frame.width, frame.height, pitch)).cast('B')
+            size = len(packed)
+            pitch = size // frame.height
+            encoding |= DumpEncoding.DUMP_ENCODING_RAW10_PACKED.value
+
+        with self._map_dump_payload(frame, packed) as data:
+            if data is None:
+                return 1
+            values = (CmdOperation.CMD_OP_GET_OK.value, cmd, 0, 0, size, frame.width, frame.height, pitch, frame.format)
+            if self._dump_encoding_negotiated:
+                header = DUMP_ENCODED_HEADER_LAYOUT.pack(*values, encoding)
+            else:
+                header = DUMP_HEADER_LAYOUT.pack(*values)
+            if encoding & DumpEncoding.DUMP_ENCODING_CHUNKED_CRC.value:
+                # keep a copy of the payload so that the host can request the missing or
+                # corrupted chunks, the frame buffer is returned to the pipeline
+                self._dump_cache = (cmd, encoding, packed if packed is not None else bytes(data))
+            if not self._send_data(header + b'DUMP DATA[', flush=False):
+                return 0
+            print("Dump capture latency: %.1f ms" % ((time.monotonic() - request_time) * 1000))
+            if not self._write_chunks(encoding, data):
+                return 0
+        self._send_data(b'DUMP DATA]')
+        return 0
+
+    def _com_event_cb(self):
+        """
+        server loop callback called when the com port is readable or in error
+        """
+        try:
+            accepted = self._transport.accept()
+        except OSError:
+            return
+        if accepted:
+            # watch the accepted host connection instead of the listening socket
+            self._remove_reader()
+            self._add_reader()
+            self._reset_session()
+            return
+        self.process_received_data()
+
+    def _set_statistic_profile(self, profile):
         # 0 = Full stats (histogram and average, up and down)
         # 1 = average up stats
         # 2 = average down stats
-        time.sleep(1.5)  # Wait for 1.5 seconds
-        self._app.gst_widget.set_libcamera_property('statistic-profile', 2)
+        self._app.gst_widget.set_libcamera_property('statistic-profile', profile.value)
+        self._delay_settle(CMD_SETTLE_FRAMES)
+
+    def _delay_settle(self, frames):
+        """
+        consider the settings applied only after the given number of new frames
+        """
+        self._settle_sequence = max(self._settle_sequence, self._app.gst_widget.frame_sequence + frames)
+
+    def start(self):
+        """
+        open the com port and start serving the commands from the server thread,
+        as soon as the serial usb gadget is enabled
+        """
+        self._start_requested = True
+        if self._gadget_ready.is_set():
+            self._start_server()
+
+    def _encode_reply(self, layout, cmd, values):
+        """
+        encode the GET reply header and values with a single pack into the reusable
+        transmission buffer
+        """
+        if layout.size > len(self._tx_buffer):
+            self._tx_buffer = bytearray(layout.size)
+        layout.pack_into(self._tx_buffer, 0, CmdOperation.CMD_OP_GET_OK.value, cmd, 0, 0, *values)
+        return memoryview(self._tx_buffer)[:layout.size]
+
+    def _wait_settings_applied(self):
+        """
+        wait for the frame from which the settings of the last SET commands are
+        applied by the pipeline
+        """
+        if not self._app.gst_widget.wait_frame_sequence(self._settle_sequence, CMD_SETTLE_TIMEOUT):
+            print("Timeout while waiting for the settings to be applied")
 
     def cleanup(self):
+        if self._server_thread is not None and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop_server)
+            self._server_thread.join(CMD_SERVER_STOP_TIMEOUT)
+        self._executor.shutdown(wait=False)
         self.__del__()
 
-    def cmd_parser_setconfig(self, data):
+    def _send_reply(self, handler, values, *counts):
         """
-        set config requested
+        send the GET reply of the handler command
         """
-        # Depending on the field structure used, alignement is done on a uint32 word for the enable field.
-        # For some configuration, the enable value is coded on a single byte or a uint32 word to match the
-        # structure alignment from uint8 to uint32 transition.
-        ret = 0
-        tempo = 0
-        values = []
-        cmd = data[1]
-        if cmd == CmdID.CMD_STATREMOVAL.value:
-            # Statistic removal not supported with the IQTune desktop application.
-            # The statistic removal is managed by the entry pad of the ISP subdev using the crop property
-            # ex: media-ctl -d $media_dev --set-v4l2 "'dcmipp_main_isp':0[crop:(0,5)/1280x713]"
-            # This command return an error
-            ret = 1
+        layout = handler.reply_layout(*counts)
+        # the transmission buffer is shared with the background worker
+        with self._tx_lock:
+            self._send_data(self._encode_reply(layout, handler.cmd, values))
+        return 0
+
+    def _set_unsupported(self, values):
+        # Statistic removal not supported with the IQTune desktop application.
+        # The statistic removal is managed by the entry pad of the ISP subdev using the crop property
+        # ex: media-ctl -d $media_dev --set-v4l2 "'dcmipp_main_isp':0[crop:(0,5)/1280x713]"
+        # Gamma is automaticaly activated by libcamera according to the role set by the user
+        # These commands return an error
+        return 1
+
+    def _get_unsupported(self, handler):
+        return 1
+
+    def _set_demosaicing(self, values):
+        enable, bayer_pattern, *filters = values
+        if enable:
+            # Skip the bayer pattern type which is already programmed and cannot be changed
+            self._app.gst_widget.set_libcamera_property('demosaicing-filters', filters)
+        self._app.gst_widget.set_libcamera_property('demosaicing-enable', enable)
+        return 0
+
+    def _get_demosaicing(self, handler):
+        enable = self._app.gst_widget.get_libcamera_property('demosaicing-enable')
+        values = self._app.gst_widget.get_libcamera_property('demosaicing-filters')
+        return self._send_reply(handler, (enable, self._app.sensor_bayer_pattern, *values))
+
+    def _get_decimation(self, handler):
+        val = self._app.gst_widget.get_libcamera_property('decimation-factor')
+        return self._send_reply(handler, (val,))
+
+    def _set_contrast(self, values):
+        enable, *values = values
+        if enable:
+            self._app.gst_widget.set_libcamera_property('contrast-values', values)
+        self._app.gst_widget.set_libcamera_property('contrast-enable', enable)
+        return 0
+
+    def _get_contrast(self, handler):
+        enable = self._app.gst_widget.get_libcamera_property('contrast-enable')
+        values = self._app.gst_widget.get_libcamera_property('contrast-values')
+        return self._send_reply(handler, (enable, *values))
+
+    def _set_statistic_area(self, values):
+        self._app.gst_widget.set_libcamera_property('statistic-area', values)
+        return 0
+
+    def _get_statistic_area(self, handler):
+        values = self._app.gst_widget.get_libcamera_property('statistic-area')
+        return self._send_reply(handler, values)
+
+    def _set_sensor_gain(self, values):
+        self._app.gst_widget.set_libcamera_property('sensor-gain', float(values[0])/1000) # convert from mdB to dB
+        return 0
+
+    def _get_sensor_gain(self, handler):
+        val = self._app.gst_widget.get_libcamera_property('sensor-gain')
+        return self._send_reply(handler, (int(val * 1000),)) # convert from dB to mdB
+
+    def _set_sensor_exposure(self, values):
+        self._app.gst_widget.set_libcamera_property('sensor-exposure', values[0])
+        return 0
+
+    def _get_sensor_exposure(self, handler):
+        val = self._app.gst_widget.get_libcamera_property('sensor-exposure')
+        return self._send_reply(handler, (val,))
+
+    def _set_badpixel_algo(self, values):
+        enable, val = values
+        if not enable:
+            val = 0
+        self._app.gst_widget.set_libcamera_property('badpixel-algo-threshold', val)
+        return 0
+
+    def _get_badpixel_algo(self, handler):
+        val = self._app.gst_widget.get_libcamera_property('badpixel-algo-threshold')
+        # the badpixel algo is disabled when the threshold is 0
+        return self._send_reply(handler, (val != 0, val))
+
+    def _set_badpixel_static(self, values):
+        enable, strength, count = values
+        if enable:
+            self._app.gst_widget.set_libcamera_property('badpixel-strength', strength)
+        self._app.gst_widget.set_libcamera_property('badpixel-enable', enable)
+        return 0
+
+    def _get_badpixel_static(self, handler):
+        enable = self._app.gst_widget.get_libcamera_property('badpixel-enable')
+        strength = self._app.gst_widget.get_libcamera_property('badpixel-strength')
+        count = self._app.gst_widget.get_libcamera_property('badpixel-count')
+        return self._send_reply(handler, (enable, strength, count))
+
+    def _set_black_level_static(self, values):
+        enable, *values = values
+        if enable:
+            self._app.gst_widget.set_libcamera_property('black-level-values', values)
+        self._app.gst_widget.set_libcamera_property('black-level-enable', enable)
+        return 0
+
+    def _get_black_level_static(self, handler):
+        enable = self._app.gst_widget.get_libcamera_property('black-level-enable')
+        values = self._app.gst_widget.get_libcamera_property('black-level-values')
+        return self._send_reply(handler, (enable, *values))
+
+    def _set_aec_algo(self, values):
+        enable, val, exptarget = values
+        if enable:
+            # convert the exposure compensation enum (steps of 0.5 EV from -4 to 4) into float value
+            self._app.gst_widget.set_libcamera_property('aec-algo-exposure-compensation', val * 0.5)
+        self._app.gst_widget.set_libcamera_property('aec-algo-enable', enable)
+        return 0
+
+    def _get_aec_algo(self, handler):
+        enable = self._app.gst_widget.get_libcamera_property('aec-algo-enable')
+        expval = self._app.gst_widget.get_libcamera_property('aec-algo-exposure-compensation')
+        exptarget = self._app.gst_widget.get_libcamera_property('aec-algo-exposure-target')
+        # convert float value to exposure compensation enum value
+        return self._send_reply(handler, (enable, round(expval * 2), exptarget))
+
+    def _set_awb_algo(self, values):
+        enable = values[0]
+        if enable:
+            # 5 profiles ID of 32 characters (32 bytes)
+            profileNames = [val.decode('utf-8') for val in values[1:6]]
+            self._app.gst_widget.set_libcamera_property('awb-algo-profile-names', profileNames)
+            # 5 reference color temperature values
+            self._app.gst_widget.set_libcamera_property('awb-algo-profile-color-temps', values[6:11])
+            # 5 ISP gain profile of 3 values
+            self._app.gst_widget.set_libcamera_property('awb-algo-profile-isp-gains', values[11:26])
+            # 5 CCM of 3x3 values
+            self._app.gst_widget.set_libcamera_property('awb-algo-profile-ccms', values[26:71])
+        self._app.gst_widget.set_libcamera_property('awb-algo-enable', enable)
+        return 0
+
+    def _get_awb_algo(self, handler):
+        enable = self._app.gst_widget.get_libcamera_property('awb-algo-enable')
+        profileNames = self._app.gst_widget.get_libcamera_property('awb-algo-profile-names')
+        refColorTemps = self._app.gst_widget.get_libcamera_property('awb-algo-profile-color-temps')
+        ispGains = self._app.gst_widget.get_libcamera_property('awb-algo-profile-isp-gains')
+        ccmCoeffs = self._app.gst_widget.get_libcamera_property('awb-algo-profile-ccms')
+        values = (enable, *[val.encode('utf-8') for val in profileNames], *refColorTemps, *ispGains, *ccmCoeffs)
+        return self._send_reply(handler, values)
+
+    def _get_awb_profile(self, handler):
+        currentProfileName = self._app.gst_widget.get_libcamera_property('awb-current-profile-name')
+        if currentProfileName is None:
+                currentProfileName = ""
+        currentColorTemp = self._app.gst_widget.get_libcamera_property('awb-current-profile-color-temp')
+        return self._send_reply(handler, (currentProfileName.encode('utf-8'), currentColorTemp))
+
+    def _set_isp_gain_static(self, values):
+        enable, *values = values
+        if enable:
+            self._app.gst_widget.set_libcamera_property('isp-gain-values', values)
+        self._app.gst_widget.set_libcamera_property('isp-gain-enable', enable)
+        return 0
+
+    def _get_isp_gain_static(self, handler):
+        enable = self._app.gst_widget.get_libcamera_property('isp-gain-enable')
+        values = self._app.gst_widget.get_libcamera_property('isp-gain-values')
+        return self._send_reply(handler, (enable, *values))
+
+    def _set_color_conv_static(self, values):
+        enable, *values = values
+        if enable:
+            self._app.gst_widget.set_libcamera_property('ccm-values', values)
+        self._app.gst_widget.set_libcamera_property('ccm-enable', enable)
+        return 0
+
+    def _get_color_conv_static(self, handler):
+        enable = self._app.gst_widget.get_libcamera_property('ccm-enable')
+        values = self._app.gst_widget.get_libcamera_property('ccm-values')
+        return self._send_reply(handler, (enable, *values))
+
+    def _get_statistic_up(self, handler):
+        # the full stats profile stays applied while the host polls the statistics
+        with self._stats_session:
+            self._wait_settings_applied()
+            avg_values = self._app.gst_widget.get_libcamera_property('statistic-get-average-up')
+            bin_values = self._app.gst_widget.get_libcamera_property('statistic-get-histogram-up')
+        return self._send_reply(handler, (*avg_values, *bin_values), len(avg_values), len(bin_values))
 
-        elif cmd == CmdID.CMD_DEMOSAICING.value:
-            # retrieve values from the command
-            enable = data[4]
-            if enable:
-                val = unpack('4B', data[6:10]) # Skip the bayer pattern type which is already programmed and cannot be changed
-                self._app.gst_widget.set_libcamera_property('demosaicing-filters', val)
-            self._app.gst_widget.set_libcamera_property('demosaicing-enable', enable)
-
-        elif cmd == CmdID.CMD_CONTRAST.value:
-            # retrieve values from the command
-            enable = data[4]
-            if enable:
-                values = unpack('<9I', data[8:44]) # padding byte inserted data[5:8] by the ctype structure alignment
-                self._app.gst_widget.set_libcamera_property('contrast-values', values)
-            self._app.gst_widget.set_libcamera_property('contrast-enable', enable)
-
-        elif cmd == CmdID.CMD_STATISTICAREA.value:
-            # retrieve values from the command
-            values = unpack('<4I', data[4:20])
-            self._app.gst_widget.set_libcamera_property('statistic-area', values)
-            tempo = 0.8 # add tempo when stat area is set to ensure that the statistic values are computed before receiving a get stat command.
-
-        elif cmd == CmdID.CMD_SENSORGAIN.value:
-            # retrieve values from the command
-            val = unpack('<1I', data[4:8])[0]
-            self._app.gst_widget.set_libcamera_property('sensor-gain', float(val)/1000) # convert from mdB to dB
-
-        elif cmd == CmdID.CMD_SENSOREXPOSURE.value:
-            # retrieve values from the command
-            val = unpack('<1I', data[4:8])[0]
-            self._app.gst_widget.set_libcamera_property('sensor-exposure', val)
-
-        elif cmd == CmdID.CMD_BADPIXELALGO.value:
-            # retrieve values from the command
-            enable = data[4]
-            if enable:
-                val = unpack('<1I', data[8:12])[0] # padding byte inserted data[5:8] by the ctype structure alignment
-                self._app.gst_widget.set_libcamera_property('badpixel-algo-threshold', val)
+    def _get_statistic_down(self, handler):
+        with self._stats_session:
+            self._wait_settings_applied()
+            avg_values = self._app.gst_widget.get_libcamera_property('statistic-get-average-down')
+            bin_values = self._app.gst_widget.get_libcamera_property('statistic-get-histogram-down')
+        return self._send_reply(handler, (*avg_values, *bin_values), len(avg_values), len(bin_values))
+
+    def _set_stats_subscription(self, values):
+        # push the statistics every 'interval' frames, 0 to unsubscribe
+        interval = values[0]
+        if interval and not self._stats_interval:
+            self._stats_session.acquire()
+            self._app.gst_widget.add_frame_listener(self._stats_frame_cb)
+        elif not interval and self._stats_interval:
+            self._app.gst_widget.remove_frame_listener(self._stats_frame_cb)
+            self._stats_session.release()
+        self._stats_interval = interval
+        # the pushed packets are framed with the request ID of the subscription
+        self._stats_request_id = getattr(self._request, 'id', 0)
+        # the first packet holds the absolute histogram bins
+        self._stats_bins = None
+        return 0
+
+    def _get_stats_subscription(self, handler):
+        return self._send_reply(handler, (self._stats_interval,))
+
+    def _stats_frame_cb(self, sequence):
+        # called in the streaming thread, the packet is built from the server loop
+        # and the frames received meanwhile are skipped
+        interval = self._stats_interval
+        if interval and sequence % interval == 0 and not self._stats_push_pending:
+            self._stats_push_pending = True
+            self._loop.call_soon_threadsafe(self._push_statistics, sequence)
+
+    def _push_statistics(self, sequence):
+        """
+        send a statistic packet with the histogram bins delta encoded when they fit
+        """
+        self._stats_push_pending = False
+        if not self._stats_interval:
+            return
+        avg_up, avg_down, bins_up, bins_down = self._app.gst_widget.get_libcamera_properties(
+            'statistic-get-average-up', 'statistic-get-average-down',
+            'statistic-get-histogram-up', 'statistic-get-histogram-down')
+        averages = (*avg_up, *avg_down)
+        bins = (*bins_up, *bins_down)
+        flags = 0
+        values = bins
+        if self._stats_bins is not None and len(self._stats_bins) == len(bins):
+            deltas = tuple(value - previous for value, previous in zip(bins, self._stats_bins))
+            if all(-0x8000 <= delta < 0x8000 for delta in deltas):
+                flags = STATS_PACKET_DELTA
+                values = deltas
+        self._stats_bins = bins
+
+        key = (len(averages), len(bins), flags)
+        layout = self._stats_layouts.get(key)
+        if layout is None:
+            layout = Struct(STATS_PACKET_HEADER_LAYOUT.format + '%dI%d%s' % (len(averages), len(bins),
+                            'h' if flags & STATS_PACKET_DELTA else 'I'))
+            self._stats_layouts[key] = layout
+        self._request.id = self._stats_request_id
+        self._send_data(layout.pack(CmdOperation.CMD_OP_GET_OK.value, CmdID.CMD_STATS_SUBSCRIBE.value, 0, 0,
+                                    sequence, flags, len(averages), len(bins), *averages, *values))
+
+    def _set_stats_history(self, values):
+        # record the statistics of every frame, 0 to stop recording
+        enable = bool(values[0])
+        if enable and not self._stats_history_enabled:
+            self._stats_history.reset()
+            self._stats_session.acquire()
+            self._app.gst_widget.add_frame_listener(self._stats_history_frame_cb)
+        elif not enable and self._stats_history_enabled:
+            self._app.gst_widget.remove_frame_listener(self._stats_history_frame_cb)
+            self._stats_session.release()
+        self._stats_history_enabled = enable
+        return 0
+
+    def _get_stats_history(self, handler, values):
+        # the samples taken from first to last ms since the history start, 0 for the latest
+        first, last = values
+        samples = self._stats_history.select(first, last or 0xFFFFFFFF)
+        if samples is None:
+            return 1
+        header = STATS_HISTORY_HEADER_LAYOUT.pack(CmdOperation.CMD_OP_GET_OK.value, handler.cmd, 0, 0,
+                                                  len(samples), samples.dtype.itemsize,
+                                                  *self._stats_history.nb_averages())
+        self._send_data(header + samples.tobytes())
+        return 0
+
+    def _stats_history_frame_cb(self, sequence):
+        # called in the streaming thread, the frames received while the previous
+        # sample is read are missing from the history
+        if not self._stats_sample_pending:
+            self._stats_sample_pending = True
+            self._loop.call_soon_threadsafe(self._sample_statistics, sequence, time.monotonic())
+
+    def _sample_statistics(self, sequence, timestamp):
+        self._stats_sample_pending = False
+        if not self._stats_history_enabled:
+            return
+        avg_up, avg_down, gain, exposure, profile_name, color_temp = self._app.gst_widget.get_libcamera_properties(
+            'statistic-get-average-up', 'statistic-get-average-down', 'sensor-gain', 'sensor-exposure',
+            'awb-current-profile-name', 'awb-current-profile-color-temp')
+        self._stats_history.append(sequence, timestamp, avg_up, avg_down, int(gain * 1000), exposure,
+                                   (profile_name or "").encode('utf-8'), color_temp)
+
+    def _dump_frame(self, handler, stream):
+        """
+        capture the next frame of the stream and send it
+        """
+        # Wait parameter are applied before asking for a dump
+        self._wait_settings_applied()
+        request_time = time.monotonic()
+        self._app.gst_widget.request_dump(stream)
+        # Wait while dump is really performed
+        if not self._app.gst_widget.wait_dump(CMD_DUMP_TIMEOUT):
+            print("Timeout while waiting for the " + stream + " frame dump")
+            return 1
+
+        # if dump size if 0 then return error
+        frame = self._app.gst_widget.take_dump()
+        if frame.size == 0:
+            return 1
+        # The frame buffer is streamed after the metadata frame information
+        return self._send_dump(handler.cmd, stream, frame, request_time)
+
+    def _get_dump_resend(self, handler, values):
+        first, count = values
+        if self._dump_cache is None:
+            return 1
+        cmd, encoding, data = self._dump_cache
+        if not self._send_data(DUMP_RESEND_HEADER_LAYOUT.pack(CmdOperation.CMD_OP_GET_OK.value,
+                                                              handler.cmd, 0, 0, cmd) + b'DUMP DATA[', flush=False):
+            return 0
+        if not self._write_chunks(encoding, data, first, count):
+            return 0
+        self._send_data(b'DUMP DATA]')
+        return 0
+
+    def _get_dump_raw_burst(self, handler, values):
+        """
+        capture a burst of consecutive raw frames and send them all, or only the
+        mean and variance of each pixel computed on the device
+        """
+        nb_frames, mode = values
+        if mode not in (BurstMode.BURST_MODE_FRAMES.value, BurstMode.BURST_MODE_STATISTICS.value):
+            return 1
+        self._wait_settings_applied()
+        request_time = time.monotonic()
+        if not self._app.gst_widget.request_burst(nb_frames):
+            return 1
+        if not self._app.gst_widget.wait_dump(CMD_DUMP_TIMEOUT + nb_frames * CMD_BURST_FRAME_TIMEOUT):
+            print("Timeout while waiting for the raw burst")
+            return 1
+
+        frames, width, height, pitch, format = self._app.gst_widget.take_burst()
+        if len(frames) != nb_frames:
+            return 1
+        if mode == BurstMode.BURST_MODE_STATISTICS.value:
+            payloads = (memoryview(bayer_statistics(frames, width)).cast('B'),)
+        else:
+            payloads = [memoryview(frame).cast('B') for frame in frames]
+        # the burst payloads are small enough to be sent without the chunk CRC
+        encoding = self._dump_encoding & DumpEncoding.DUMP_ENCODING_ZLIB.value
+        header = DUMP_BURST_HEADER_LAYOUT.pack(CmdOperation.CMD_OP_GET_OK.value, handler.cmd, 0, 0,
+                                               nb_frames, mode, len(payloads[0]), width, height,
+                                               pitch, format, encoding)
+        if not self._send_data(header, flush=False):
+            return 0
+        print("Raw burst capture latency: %.1f ms" % ((time.monotonic() - request_time) * 1000))
+        for data in payloads:
+            if not self._send_data(b'DUMP DATA[', flush=False) or not self._write_chunks(encoding, data):
+                return 0
+            if not self._send_data(b'DUMP DATA]'):
+                return 0
+        return 0
+
+    def _get_dump_preview_frame(self, handler):
+        return self._dump_frame(handler, 'preview')
+
+    def _get_dump_isp_frame(self, handler):
+        return self._dump_frame(handler, 'rgb')
+
+    def _get_dump_raw_frame(self, handler):
+        return self._dump_frame(handler, 'raw')
+
+    def _set_preview(self, values):
+        # With Gstreamer implementation we do not need to stop/start the preview to capture frames
+        # Simply skip the stop/start preview request.
+        return 0
+
+    def _get_dcmipp_version(self, handler):
+        values = self._app.gst_widget.get_libcamera_property('hw-revision')
+        return self._send_reply(handler, values, len(values))
+
+    def _get_sensor_info(self, handler):
+        if self._app.sensor_pixel_depth is None:
+            # the pixel depth is only known once the raw pad caps are negotiated
+            print("Sensor information requested before the raw stream is negotiated")
+            return 1
+        values = (self._app.sensor_name.encode('utf-8'),
+                  self._app.sensor_bayer_pattern, self._app.sensor_pixel_depth,
+                  self._app.sensor_width, self._app.sensor_height,
+                  self._app.sensor_gain_min, self._app.sensor_gain_max,
+                  self._app.sensor_expo_min, self._app.sensor_expo_max)
+        return self._send_reply(handler, values)
+
+    def _get_capabilities(self, handler):
+        capabilities = CmdCapability.CMD_CAP_DUMP_ENCODING.value | CmdCapability.CMD_CAP_DUMP_RAW_BURST.value \
+                     | CmdCapability.CMD_CAP_PIPELINING.value | CmdCapability.CMD_CAP_STATS_SUBSCRIBE.value \
+                     | CmdCapability.CMD_CAP_STATS_HISTORY.value | CmdCapability.CMD_CAP_BATCH.value
+        return self._send_reply(handler, (capabilities, DUMP_SUPPORTED_ENCODINGS))
+
+    def _set_dump_encoding(self, values):
+        # the hosts not sending this command keep receiving the uncompressed dump format
+        self._dump_encoding = values[0] & DUMP_SUPPORTED_ENCODINGS
+        self._dump_encoding_negotiated = True
+        return 0
+
+    def _get_dump_encoding(self, handler):
+        return self._send_reply(handler, (self._dump_encoding,))
+
+    def _set_pipelining(self, values):
+        # the acknowledge of this command is already framed when pipelining is enabled
+        self._pipelining = bool(values[0])
+        return 0
+
+    def _get_pipelining(self, handler):
+        return self._send_reply(handler, (int(self._pipelining),))
+
+    def _get_batch(self, handler, payload):
+        """
+        process the SET and GET command frames of the payload in order and send
+        all their answers in a single reply
+        """
+        # the batch is checked whole before any setting is applied
+        frames = []
+        offset = 0
+        while offset < len(payload):
+            if len(payload) - offset < CMD_HEADER_SIZE:
+                return 1
+            operation = payload[offset]
+            entry_handler = CMD_HANDLERS.get(payload[offset + 1])
+            if entry_handler is None or entry_handler.background or entry_handler.get_length_layout is not None:
+                # the dumps and the nested batches cannot be part of a batch
+                return 1
+            if operation == CmdOperation.CMD_OP_SET.value:
+                size = entry_handler.set_frame_size()
+            elif operation == CmdOperation.CMD_OP_GET.value:
+                size = entry_handler.get_frame_size()
             else:
-                self._app.gst_widget.set_libcamera_property('badpixel-algo-threshold', 0)
-
-        elif cmd == CmdID.CMD_BADPIXELSTATIC.value:
-            # retrieve values from the command
-            enable = data[4]
-            if enable:
-                val = data[5]
-                self._app.gst_widget.set_libcamera_property('badpixel-strength', val)
-            self._app.gst_widget.set_libcamera_property('badpixel-enable', enable)
-
-        elif cmd == CmdID.CMD_BLACKLEVELSTATIC.value:
-            # retrieve values from the command
-            enable = data[4]
-            if enable:
-                values = unpack('3B', data[5:8])
-                self._app.gst_widget.set_libcamera_property('black-level-values', values)
-            self._app.gst_widget.set_libcamera_property('black-level-enable', enable)
-
-        elif cmd == CmdID.CMD_AECALGO.value:
-            # retrieve values from the command
-            enable = data[4]
-            if enable:
-                val = data[5]
-                # convert the exposure compensation enum into float value
-                if ctypes.c_int8(val).value == -4:
-                    val = -2.0
-                elif ctypes.c_int8(val).value == -3:
-                    val = -1.5
-                elif ctypes.c_int8(val).value == -2:
-                    val = -1.0
-                elif ctypes.c_int8(val).value == -1:
-                    val = -0.5
-                elif ctypes.c_int8(val).value == 0:
-                    val = 0.0
-                elif ctypes.c_int8(val).value == 1:
-                    val = 0.5
-                elif ctypes.c_int8(val).value == 2:
-                    val = 1.0
-                elif ctypes.c_int8(val).value == 3:
-                    val = 1.5
-                elif ctypes.c_int8(val).value == 4:
-                    val = 2.0
-                self._app.gst_widget.set_libcamera_property('aec-algo-exposure-compensation', val)
-            self._app.gst_widget.set_libcamera_property('aec-algo-enable', enable)
-
-        elif cmd == CmdID.CMD_AWBALGO.value:
-            # retrieve values from the command
-            enable = data[4]
-            if enable:
-                profileNames = []
-                profileNames.append(data[5:37].decode('utf-8'))    #
-                profileNames.append(data[37:69].decode('utf-8'))   #
-                profileNames.append(data[69:101].decode('utf-8'))  # 5 profiles ID of 32 characters (32 bytes)
-                profileNames.append(data[101:133].decode('utf-8')) #
-                profileNames.append(data[133:165].decode('utf-8')) #
-                self._app.gst_widget.set_libcamera_property('awb-algo-profile-names', profileNames)
-                # padding byte inserted data[165:168] by the ctype structure alignment
-                refColorTemps = unpack('<5I', data[168:188]) # 5 reference color temperature values of 4 bytes
-                self._app.gst_widget.set_libcamera_property('awb-algo-profile-color-temps', refColorTemps)
-                ispGains = unpack('<15I', data[188:248]) # 5 ISP gain profile of 3 values of 4 bytes
-                self._app.gst_widget.set_libcamera_property('awb-algo-profile-isp-gains', ispGains)
-                ccmCoeffs = unpack('<45i', data[248:428]) # 5 CCM of 3x3 values of 4 bytes
-                self._app.gst_widget.set_libcamera_property('awb-algo-profile-ccms', ccmCoeffs)
-            self._app.gst_widget.set_libcamera_property('awb-algo-enable', enable)
-
-        elif cmd == CmdID.CMD_ISPGAINSTATIC.value:
-            # retrieve values from the command
-            enable = data[4]
-            if enable:
-                values = unpack('<3I', data[8:20]) # padding byte inserted data[5:8] by the ctype structure alignment
-                self._app.gst_widget.set_libcamera_property('isp-gain-values', values)
-            self._app.gst_widget.set_libcamera_property('isp-gain-enable', enable)
-
-        elif cmd == CmdID.CMD_COLORCONVSTATIC.value:
-            # retrieve values from the command
-            enable = data[4]
-            if enable:
-                values = unpack('<9i', data[8:44]) # padding byte inserted data[5:8] by the ctype structure alignment
-                self._app.gst_widget.set_libcamera_property('ccm-values', values)
-            self._app.gst_widget.set_libcamera_property('ccm-enable', enable)
-
-        elif cmd == CmdID.CMD_STOPPREVIEW.value:
-            # With Gstreamer implementation we do not need to stop/start the preview to capture frames
-            # Simply skip the stop preview request.
-            ret = 0
-
-        elif cmd == CmdID.CMD_STARTPREVIEW.value:
-            # With Gstreamer implementation we do not need to stop/start the preview to capture frames
-            # Simply skip the start preview request.
-            ret = 0
-
-        elif cmd == CmdID.CMD_GAMMA.value:
-            # Gamma is automaticaly activated by libcamera according to the role set by the user
-            # This command return an error
-            ret = 1
+                size = None
+            if size is None or offset + size > len(payload):
+                return 1
+            frames.append(payload[offset:offset + size])
+            offset += size
 
-        elif cmd == CmdID.CMD_SENSORTESTPATTERN.value:
-            print("CMD_SENSORTESTPATTERN")
+        self._request.replies = replies = []
+        try:
+            # the consecutive SET commands are committed together, before the next GET
+            for operation, group in itertools.groupby(frames, key=lambda frame: frame[0]):
+                if operation == CmdOperation.CMD_OP_SET.value:
+                    with self._app.gst_widget.transaction():
+                        for frame in group:
+                            self.cmd_parser_setconfig(frame)
+                else:
+                    for frame in group:
+                        self.cmd_parser_getconfig(frame)
+        finally:
+            self._request.replies = None
+        reply = bytearray(CMD_BATCH_REPLY_HEADER_LAYOUT.pack(CmdOperation.CMD_OP_GET_OK.value, handler.cmd, 0, 0,
+                                                             len(replies)))
+        for data in replies:
+            reply += CMD_BATCH_ENTRY_LAYOUT.pack(len(data))
+            reply += data
+        self._send_data(reply)
+        return 0
+
+    def _set_sensor_test_pattern(self, values):
+        print("CMD_SENSORTESTPATTERN")
+        return 0
+
+    def _get_sensor_test_pattern(self, handler):
+        print("CMD_SENSORTESTPATTERN")
+        return self._send_reply(handler, ())
 
-        else:
+    def cmd_parser_setconfig(self, data):
+        """
+        set config requested
+        """
+        cmd = data[1]
+        handler = CMD_HANDLERS.get(cmd)
+        if handler is None or handler.set_config is None:
             print("Unkown set config command (" + str(cmd) + ")")
             ret = 1
+        else:
+            values = handler.set_layout.unpack_from(data, CMD_HEADER_SIZE)
+            try:
+                # the properties of a command are updated on the same frame
+                with self._app.gst_widget.transaction():
+                    ret = handler.set_config(self, values)
+            except TimeoutError as exc:
+                print("Set config command (" + str(cmd) + ") failed: ", exc)
+                ret = 1
 
-        # send command anwser
-        tempo += 0.15 # tempo of minimum 0.1 seconds before sending back the command
-        time.sleep(tempo)
+        # send command anwser as soon as the property is applied, the GET commands
+        # depending on the new settings wait for them to reach the pipeline
         if ret:
             tx_data = bytes([CmdOperation.CMD_OP_GET_FAILURE.value, cmd, ret])
             self._send_data(tx_data)
             return False
 
+        self._delay_settle(handler.settle_frames)
         tx_data = bytes([CmdOperation.CMD_OP_GET_OK.value, cmd])
         self._send_data(tx_data)
         return True
@@ -315,278 +1588,61 @@ class IQTuneCom():
         """
         get config requested
         """
-        # Depending on the field structure used, alignement is done on a uint32 word for the enable field.
-        # For some configuration, the enable value is coded on a single byte or a uint32 word to match the
-        # structure alignment from uint8 to uint32 transition.
-        ret = 0
         cmd = data[1]
-        if cmd == CmdID.CMD_STATREMOVAL.value:
-            # Statistic removal not supported with the IQTune desktop application.
-            # The statistic removal is managed by the entry pad of the ISP subdev using the crop property
-            # ex: media-ctl -d $media_dev --set-v4l2 "'dcmipp_main_isp':0[crop:(0,5)/1280x713]"
-            ret = 1
-
-        elif cmd == CmdID.CMD_DECIMATION.value:
-            val = self._app.gst_widget.get_libcamera_property('decimation-factor')
-            read_values = pack('B', val)
-
-        elif cmd == CmdID.CMD_DEMOSAICING.value:
-            enable = self._app.gst_widget.get_libcamera_property('demosaicing-enable')
-            values = self._app.gst_widget.get_libcamera_property('demosaicing-filters')
-            read_values = pack('B', enable)
-            read_values = read_values + pack('B', self._app.sensor_bayer_pattern)
-            for val in values:
-                read_values = read_values + pack('B', val)
-
-        elif cmd == CmdID.CMD_CONTRAST.value:
-            enable = self._app.gst_widget.get_libcamera_property('contrast-enable')
-            values = self._app.gst_widget.get_libcamera_property('contrast-values')
-            read_values = pack('<I', enable)
-            for val in values:
-                read_values = read_values + pack('<I', val)
-
-        elif cmd == CmdID.CMD_STATISTICAREA.value:
-            values = self._app.gst_widget.get_libcamera_property('statistic-area')
-            read_values = b''
-            for val in values:
-                read_values = read_values + pack('<I', val)
-
-        elif cmd == CmdID.CMD_SENSORGAIN.value:
-            val = self._app.gst_widget.get_libcamera_property('sensor-gain')
-            read_values = pack('<I', int(val * 1000)) # convert from dB to mdB
-
-        elif cmd == CmdID.CMD_SENSOREXPOSURE.value:
-            val = self._app.gst_widget.get_libcamera_property('sensor-exposure')
-            read_values = pack('<I', val)
-
-        elif cmd == CmdID.CMD_BADPIXELALGO.value:
-            val = self._app.gst_widget.get_libcamera_property('badpixel-algo-threshold')
-            if val == 0:
-                # the badpixel algo is disabled
-                read_values = pack('<I', False)
-            else:
-                # the badpixel algo is enabled
-                read_values = pack('<I', True)
-            read_values = read_values + pack('<I', val)
-
-        elif cmd == CmdID.CMD_BADPIXELSTATIC.value:
-            enable = self._app.gst_widget.get_libcamera_property('badpixel-enable')
-            strength = self._app.gst_widget.get_libcamera_property('badpixel-strength')
-            count = self._app.gst_widget.get_libcamera_property('badpixel-count')
-            read_values = pack('B', enable)
-            read_values = read_values + pack('B', strength)
-            read_values = read_values + b'\x00' * 2 # padding to keep c-type structure aligned
-            read_values = read_values + pack('<I', count)
-
-        elif cmd == CmdID.CMD_BLACKLEVELSTATIC.value:
-            enable = self._app.gst_widget.get_libcamera_property('black-level-enable')
-            values = self._app.gst_widget.get_libcamera_property('black-level-values')
-            read_values = pack('B', enable)
-            for val in values:
-                read_values = read_values + pack('B', val)
-
-        elif cmd == CmdID.CMD_AECALGO.value:
-            enable = self._app.gst_widget.get_libcamera_property('aec-algo-enable')
-            expval = self._app.gst_widget.get_libcamera_property('aec-algo-exposure-compensation')
-            exptarget = self._app.gst_widget.get_libcamera_property('aec-algo-exposure-target')
-            # convert float value to exposure compensation enum value
-            if expval == -2.0:
-                expval = -4
-            elif expval == -1.5:
-                expval = -3
-            elif expval == -1.0:
-                expval = -2
-            elif expval == -0.5:
-                expval = -1
-            elif expval == 0.0:
-                expval = 0
-            elif expval == 0.5:
-                expval = 1
-            elif expval == 1.0:
-                expval = 2
-            elif expval == 1.5:
-                expval = 3
-            elif expval == 2.0:
-                expval = 4
-            read_values = pack('B', enable)
-            read_values = read_values + pack('b', expval)
-            read_values = read_values + b'\x00' * 2 # padding to keep c-type structure aligned
-            read_values = read_values + pack('<I', exptarget)
-
-        elif cmd == CmdID.CMD_AWBALGO.value:
-            enable = self._app.gst_widget.get_libcamera_property('awb-algo-enable')
-            profileNames = self._app.gst_widget.get_libcamera_property('awb-algo-profile-names')
-            refColorTemps = self._app.gst_widget.get_libcamera_property('awb-algo-profile-color-temps')
-            ispGains = self._app.gst_widget.get_libcamera_property('awb-algo-profile-isp-gains')
-            ccmCoeffs = self._app.gst_widget.get_libcamera_property('awb-algo-profile-ccms')
-            read_values = pack('B', enable)
-            for val in profileNames:
-                read_values = read_values + val.encode('utf-8') + b'\x00' * (32 - len(val)) # 32 bytes aligned
-            read_values = read_values + b'\x00' * 3 # padding to keep c-type structure aligned
-            for val in refColorTemps:
-                read_values = read_values + pack('<I', val)
-            for val in ispGains:
-                read_values = read_values + pack('<I', val)
-            for val in ccmCoeffs:
-                read_values = read_values + pack('<i', val)
-
-        elif cmd == CmdID.CMD_AWBPROFILE.value:
-            currentProfileName = self._app.gst_widget.get_libcamera_property('awb-current-profile-name')
-            if currentProfileName is None:
-                    currentProfileName = ""
-            currentColorTemp = self._app.gst_widget.get_libcamera_property('awb-current-profile-color-temp')
-            read_values = currentProfileName.encode('utf-8') + b'\x00' * (32 - len(currentProfileName)) # 32 bytes aligned
-            read_values = read_values + pack('<I', currentColorTemp)
-
-        elif cmd == CmdID.CMD_ISPGAINSTATIC.value:
-            enable = self._app.gst_widget.get_libcamera_property('isp-gain-enable')
-            values = self._app.gst_widget.get_libcamera_property('isp-gain-values')
-            read_values = pack('<I', enable)
-            for val in values:
-                read_values = read_values + pack('<I', val)
-
-        elif cmd == CmdID.CMD_COLORCONVSTATIC.value:
-            enable = self._app.gst_widget.get_libcamera_property('ccm-enable')
-            values = self._app.gst_widget.get_libcamera_property('ccm-values')
-            read_values = pack('<I', enable)
-            for val in values:
-                read_values = read_values + pack('<i', val)
-
-        elif cmd == CmdID.CMD_STATISTICUP.value:
-            # Set statistic profile to get full stats:
-            # 0 = Full stats (histogram and average, up and down)
-            # 1 = average up stats
-            # 2 = average down stats
-            self._app.gst_widget.set_libcamera_property('statistic-profile', 0)
-            avg_values = self._app.gst_widget.get_libcamera_property('statistic-get-average-up')
-            bin_values = self._app.gst_widget.get_libcamera_property('statistic-get-histogram-up')
-            read_values = b''
-            for val in avg_values:
-                read_values = read_values + pack('B', val)
-            for val in bin_values:
-                read_values = read_values + pack('<I', val)
-
-        elif cmd == CmdID.CMD_STATISTICDOWN.value:
-            # Set statistic profile to get full stats:
-            # 0 = Full stats (histogram and average, up and down)
-            # 1 = average up stats
-            # 2 = average down stats
-            self._app.gst_widget.set_libcamera_property('statistic-profile', 0)
-            avg_values = self._app.gst_widget.get_libcamera_property('statistic-get-average-down')
-            bin_values = self._app.gst_widget.get_libcamera_property('statistic-get-histogram-down')
-            read_values = b''
-            for val in avg_values:
-                read_values = read_values + pack('B', val)
-            for val in bin_values:
-                read_values = read_values + pack('<I', val)
-            # revert back the statistic profile in some seconds
-            threading.Thread(target=self._update_statistic_profile).start()
-
-
-        elif cmd == CmdID.CMD_DUMP_PREVIEW_FRAME.value:
-            # Wait parameter are applied before asking for a preview dump
-            time.sleep(0.2)
-            self._app.gst_widget.dump_preview = True
-            # Wait while dump is really performed
-            while self._app.gst_widget.dump_preview:
-                time.sleep(0.01)
-
-            # if dump size if 0 then return error
-            if self._app.gst_widget.dump_size == 0:
-                ret = 1
-
-            # Fill read_values variable with the metadata frame information concatenate with the buffer itself
-            read_values = b''
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_size)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_width)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_height)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_pitch)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_format)
-            read_values = read_values + b'DUMP DATA[' + self._app.gst_widget.dump_buffer + b'DUMP DATA]'
-
-        elif cmd == CmdID.CMD_DUMP_ISP_FRAME.value:
-            self._app.gst_widget.dump_rgb = True
-            # Wait while dump is really performed
-            while self._app.gst_widget.dump_rgb:
-                time.sleep(0.01)
-
-            # if dump size if 0 then return error
-            if self._app.gst_widget.dump_size == 0:
-                ret = 1
-
-            # Fill read_values variable with the metadata frame information concatenate with the buffer itself
-            read_values = b''
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_size)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_width)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_height)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_pitch)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_format)
-            read_values = read_values + b'DUMP DATA[' + self._app.gst_widget.dump_buffer + b'DUMP DATA]'
-
-        elif cmd == CmdID.CMD_DUMP_RAW_FRAME.value:
-            self._app.gst_widget.dump_raw = True
-            # Wait while dump is really performed
-            while self._app.gst_widget.dump_raw:
-                time.sleep(0.01)
-
-            # if dump size if 0 then return error
-            if self._app.gst_widget.dump_size == 0:
-                ret = 1
-
-            # Fill read_values variable with the metadata frame information concatenate with the buffer itself
-            read_values = b''
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_size)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_width)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_height)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_pitch)
-            read_values = read_values + pack('<I', self._app.gst_widget.dump_format)
-            read_values = read_values + b'DUMP DATA[' + self._app.gst_widget.dump_buffer + b'DUMP DATA]'
-
-        elif cmd == CmdID.CMD_DCMIPPVERSION.value:
-            values = self._app.gst_widget.get_libcamera_property('hw-revision')
-            read_values = b''
-            for val in values:
-                read_values = read_values + pack('<I', val)
-
-        elif cmd == CmdID.CMD_GAMMA.value:
-            # Gamma is automaticaly activated by libcamera according to the role set by the user
-            # This command return an error
-            ret = 1
-
-        elif cmd == CmdID.CMD_SENSORINFO.value:
-            read_values = b''
-            read_values = read_values + self._app.sensor_name.encode('utf-8') + b'\x00' * (32 - len(self._app.sensor_name)) # 32 bytes aligned
-            read_values = read_values + pack('B', self._app.sensor_bayer_pattern)
-            read_values = read_values + pack('B', self._app.sensor_pixel_depth)
-            read_values = read_values + b'\x00' * 2 # padding to keep c-type structure aligned
-            read_values = read_values + pack('<I', self._app.sensor_width)
-            read_values = read_values + pack('<I', self._app.sensor_height)
-            read_values = read_values + pack('<I', self._app.sensor_gain_min)
-            read_values = read_values + pack('<I', self._app.sensor_gain_max)
-            read_values = read_values + pack('<I', self._app.sensor_expo_min)
-            read_values = read_values + pack('<I', self._app.sensor_expo_max)
-
-        elif cmd == CmdID.CMD_SENSORTESTPATTERN.value:
-            print("CMD_SENSORTESTPATTERN")
-        else:
+        handler = CMD_HANDLERS.get(cmd)
+        if handler is None or handler.get_config is None:
             print("Unkown get config command (" + str(cmd) + ")")
             ret = 1
+        else:
+            try:
+                ret = self._call_get_config(handler, data)
+            except TimeoutError as exc:
+                print("Get config command (" + str(cmd) + ") failed: ", exc)
+                ret = 1
 
-        # send command anwser
+        # send command failure anwser
         if ret:
             tx_data = bytes([CmdOperation.CMD_OP_GET_FAILURE.value, cmd, ret])
             self._send_data(tx_data)
             return False
-
-        tx_data = bytes([CmdOperation.CMD_OP_GET_OK.value, cmd, 0, 0]) + read_values
-        self._send_data(tx_data)
         return True
 
+    def _call_get_config(self, handler, data):
+        """
+        call the GET handler with the values of the request, the handler sends the
+        reply itself when successful
+        """
+        if handler.get_length_layout is not None:
+            # command of variable size: give the raw payload, the oversized commands
+            # are received without it
+            length, = handler.get_length_layout.unpack_from(data, CMD_HEADER_SIZE)
+            payload = data[CMD_HEADER_SIZE + handler.get_length_layout.size:]
+            if len(payload) != length:
+                print("Command too large (" + str(length) + " bytes) dropped")
+                return 1
+            return handler.get_config(self, handler, payload)
+        if handler.get_request_layout is not None:
+            return handler.get_config(self, handler, handler.get_request_layout.unpack_from(data, CMD_HEADER_SIZE))
+        return handler.get_config(self, handler)
+
+    def _process_in_background(self, request_id, data):
+        self._request.id = request_id
+        self.cmd_parser_getconfig(data)
+
     def cmd_parser_process_command(self, data):
         """
         parse the received data
         """
         operation = data[0]
+        # the padding bytes of the command header carry the request ID
+        request_id = data[2] | (data[3] << 8)
+        if self._pipelining and operation == CmdOperation.CMD_OP_GET.value:
+            handler = CMD_HANDLERS.get(data[1])
+            if handler is not None and handler.background:
+                # the received data is copied as the reception buffer is reused
+                self._loop.run_in_executor(self._executor, self._process_in_background, request_id, bytes(data))
+                return True
+        self._request.id = request_id
         if operation == CmdOperation.CMD_OP_SET.value:
             self.cmd_parser_setconfig(data)
         elif operation == CmdOperation.CMD_OP_GET.value:
@@ -596,14 +1652,134 @@ class IQTuneCom():
 
         return True
 
-    def loop(self):
+    def process_received_data(self):
         """
-        loop function call as a gtk idle function to check com port reception
-        regularly
+        read the com port and process all the commands received
         """
-        data = self._get_data()
-        if data:
-            if not self.cmd_parser_process_command(data):
-                print("Error while processing the received command")
+        if self._get_data():
+            # process every complete command received so far
+            for data in self._decoder.frames():
+                if not self.cmd_parser_process_command(data):
+                    print("Error while processing the received command")
+
+        return True
 
-        return True
\ No newline at end of file
+# Registry of the commands handled by IQTuneCom indexed by command ID.
+# Depending on the field structure used, alignement is done on a uint32 word for the enable field.
+# For some configuration, the enable value is coded on a single byte or a uint32 word to match the
+# structure alignment from uint8 to uint32 transition: the padding bytes are part of the layouts.
+CMD_HANDLERS = {handler.cmd: handler for handler in (
+  CmdHandler(CmdID.CMD_STATREMOVAL,
+             set_config=IQTuneCom._set_unsupported, set_layout=Struct('<B3x2I'),
+             get_config=IQTuneCom._get_unsupported),
+  CmdHandler(CmdID.CMD_DECIMATION,
+             get_config=IQTuneCom._get_decimation, get_layout=Struct('<4BB'),
+             properties=('decimation-factor',)),
+  CmdHandler(CmdID.CMD_DEMOSAICING,
+             set_config=IQTuneCom._set_demosaicing, set_layout=Struct('<BB4B'),
+             get_config=IQTuneCom._get_demosaicing, get_layout=Struct('<4BBB4B'),
+             properties=('demosaicing-enable', 'demosaicing-filters')),
+  CmdHandler(CmdID.CMD_CONTRAST,
+             set_config=IQTuneCom._set_contrast, set_layout=Struct('<B3x9I'),
+             get_config=IQTuneCom._get_contrast, get_layout=Struct('<4BI9I'),
+             properties=('contrast-enable', 'contrast-values')),
+  CmdHandler(CmdID.CMD_STATISTICAREA,
+             set_config=IQTuneCom._set_statistic_area, set_layout=Struct('<4I'),
+             get_config=IQTuneCom._get_statistic_area, get_layout=Struct('<4B4I'),
+             properties=('statistic-area',),
+             # ensure that the statistic values are computed before answering a get stat command
+             settle_frames=CMD_SETTLE_FRAMES_STATISTICAREA),
+  CmdHandler(CmdID.CMD_SENSORGAIN,
+             set_config=IQTuneCom._set_sensor_gain, set_layout=Struct('<I'),
+             get_config=IQTuneCom._get_sensor_gain, get_layout=Struct('<4BI'),
+             properties=('sensor-gain',)),
+  CmdHandler(CmdID.CMD_SENSOREXPOSURE,
+             set_config=IQTuneCom._set_sensor_exposure, set_layout=Struct('<I'),
+             get_config=IQTuneCom._get_sensor_exposure, get_layout=Struct('<4BI'),
+             properties=('sensor-exposure',)),
+  CmdHandler(CmdID.CMD_BADPIXELALGO,
+             set_config=IQTuneCom._set_badpixel_algo, set_layout=Struct('<B3xI'),
+             get_config=IQTuneCom._get_badpixel_algo, get_layout=Struct('<4BII'),
+             properties=('badpixel-algo-threshold',)),
+  CmdHandler(CmdID.CMD_BADPIXELSTATIC,
+             set_config=IQTuneCom._set_badpixel_static, set_layout=Struct('<BB2xI'),
+             get_config=IQTuneCom._get_badpixel_static, get_layout=Struct('<4BBB2xI'),
+             properties=('badpixel-enable', 'badpixel-strength', 'badpixel-count')),
+  CmdHandler(CmdID.CMD_BLACKLEVELSTATIC,
+             set_config=IQTuneCom._set_black_level_static, set_layout=Struct('<B3B'),
+             get_config=IQTuneCom._get_black_level_static, get_layout=Struct('<4BB3B'),
+             properties=('black-level-enable', 'black-level-values')),
+  CmdHandler(CmdID.CMD_AECALGO,
+             set_config=IQTuneCom._set_aec_algo, set_layout=Struct('<Bb2xI'),
+             get_config=IQTuneCom._get_aec_algo, get_layout=Struct('<4BBb2xI'),
+             properties=('aec-algo-enable', 'aec-algo-exposure-compensation', 'aec-algo-exposure-target')),
+  CmdHandler(CmdID.CMD_AWBALGO,
+             set_config=IQTuneCom._set_awb_algo, set_layout=Struct('<B' + '32s' * 5 + '3x5I15I45i'),
+             get_config=IQTuneCom._get_awb_algo, get_layout=Struct('<4BB' + '32s' * 5 + '3x5I15I45i'),
+             properties=('awb-algo-enable', 'awb-algo-profile-names', 'awb-algo-profile-color-temps',
+                         'awb-algo-profile-isp-gains', 'awb-algo-profile-ccms')),
+  CmdHandler(CmdID.CMD_AWBPROFILE,
+             get_config=IQTuneCom._get_awb_profile, get_layout=Struct('<4B32sI'),
+             properties=('awb-current-profile-name', 'awb-current-profile-color-temp')),
+  CmdHandler(CmdID.CMD_ISPGAINSTATIC,
+             set_config=IQTuneCom._set_isp_gain_static, set_layout=Struct('<B3x3I'),
+             get_config=IQTuneCom._get_isp_gain_static, get_layout=Struct('<4BI3I'),
+             properties=('isp-gain-enable', 'isp-gain-values')),
+  CmdHandler(CmdID.CMD_COLORCONVSTATIC,
+             set_config=IQTuneCom._set_color_conv_static, set_layout=Struct('<B3x9i'),
+             get_config=IQTuneCom._get_color_conv_static, get_layout=Struct('<4BI9i'),
+             properties=('ccm-enable', 'ccm-values')),
+  CmdHandler(CmdID.CMD_STATISTICUP,
+             get_config=IQTuneCom._get_statistic_up, get_format='<4B%dB%dI',
+             properties=('statistic-profile', 'statistic-get-average-up', 'statistic-get-histogram-up')),
+  CmdHandler(CmdID.CMD_STATISTICDOWN,
+             get_config=IQTuneCom._get_statistic_down, get_format='<4B%dB%dI',
+             properties=('statistic-profile', 'statistic-get-average-down', 'statistic-get-histogram-down')),
+  CmdHandler(CmdID.CMD_DUMP_PREVIEW_FRAME,
+             get_config=IQTuneCom._get_dump_preview_frame, background=True),
+  CmdHandler(CmdID.CMD_DUMP_ISP_FRAME,
+             get_config=IQTuneCom._get_dump_isp_frame, background=True),
+  CmdHandler(CmdID.CMD_DUMP_RAW_FRAME,
+             get_config=IQTuneCom._get_dump_raw_frame, background=True),
+  CmdHandler(CmdID.CMD_STOPPREVIEW,
+             set_config=IQTuneCom._set_preview, set_layout=Struct('<')),
+  CmdHandler(CmdID.CMD_STARTPREVIEW,
+             set_config=IQTuneCom._set_preview, set_layout=Struct('<')),
+  CmdHandler(CmdID.CMD_DCMIPPVERSION,
+             get_config=IQTuneCom._get_dcmipp_version, get_format='<4B%dI',
+             properties=('hw-revision',)),
+  CmdHandler(CmdID.CMD_GAMMA,
+             set_config=IQTuneCom._set_unsupported, set_layout=Struct('<B'),
+             get_config=IQTuneCom._get_unsupported),
+  CmdHandler(CmdID.CMD_SENSORINFO,
+             get_config=IQTuneCom._get_sensor_info, get_layout=Struct('<4B32sBB2x6I')),
+  CmdHandler(CmdID.CMD_SENSORTESTPATTERN,
+             set_config=IQTuneCom._set_sensor_test_pattern, set_layout=Struct('<i'),
+             get_config=IQTuneCom._get_sensor_test_pattern, get_layout=Struct('<4B')),
+  CmdHandler(CmdID.CMD_CAPABILITIES,
+             get_config=IQTuneCom._get_capabilities, get_layout=Struct('<4BII')),
+  CmdHandler(CmdID.CMD_DUMP_ENCODING,
+             set_config=IQTuneCom._set_dump_encoding, set_layout=Struct('<I'),
+             get_config=IQTuneCom._get_dump_encoding, get_layout=Struct('<4BI'),
+             settle_frames=0),
+  CmdHandler(CmdID.CMD_DUMP_RESEND,
+             get_config=IQTuneCom._get_dump_resend, get_request_layout=Struct('<II'),
+             background=True),
+  CmdHandler(CmdID.CMD_DUMP_RAW_BURST,
+             get_config=IQTuneCom._get_dump_raw_burst, get_request_layout=Struct('<IB3x'),
+             background=True),
+  CmdHandler(CmdID.CMD_PIPELINING,
+             set_config=IQTuneCom._set_pipelining, set_layout=Struct('<I'),
+             get_config=IQTuneCom._get_pipelining, get_layout=Struct('<4BI'),
+             settle_frames=0),
+  CmdHandler(CmdID.CMD_STATS_SUBSCRIBE,
+             set_config=IQTuneCom._set_stats_subscription, set_layout=Struct('<I'),
+             get_config=IQTuneCom._get_stats_subscription, get_layout=Struct('<4BI'),
+             settle_frames=0),
+  CmdHandler(CmdID.CMD_STATS_HISTORY,
+             set_config=IQTuneCom._set_stats_history, set_layout=Struct('<I'),
+             get_config=IQTuneCom._get_stats_history, get_request_layout=STATS_HISTORY_REQUEST_LAYOUT,
+             settle_frames=0),
+  CmdHandler(CmdID.CMD_BATCH,
+             get_config=IQTuneCom._get_batch, get_length_layout=CMD_BATCH_LENGTH_LAYOUT),
+)}
@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2024 STMicroelectronics.
+# All rights reserved.
+#
+# This software is licensed under terms that can be found in the LICENSE file
+# in the root directory of this software component.
+# If no LICENSE file comes with this software, it is provided AS-IS.
+
+import os
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('Gst', '1.0')
+# the display classes are kept apart from the pipeline: the Gtk override initializes
+# GTK when it is imported, which is not done by the headless application
+from gi.repository import Gtk
+from gi.repository import Gdk
+from gi.repository import GLib
+from gi.repository import Gst
+
+from stm32_isp_iqtune_pipeline import GstPipeline, PREVIEW_WIDTH, PREVIEW_HEIGHT
+
+# Path definition
+RESOURCES_DIRECTORY = os.path.abspath(os.path.dirname(__file__)) + "/resources/"
+
+# Period of the statistic area overlay refresh in ms, about the frame period
+STAT_AREA_REFRESH_PERIOD = 33
+
+class GstWidget(Gtk.Box, GstPipeline):
+    """
+    Class that handles Gstreamer pipeline using gtkwaylandsink and appsink
+    """
+    def __init__(self, app):
+        Gtk.Box.__init__(self)
+        GstPipeline.__init__(self, app)
+        # connect the gtkwidget with the realize callback
+        self.connect('realize', self._on_realize)
+
+    def _on_realize(self, widget):
+        self._camera_pipeline_creation()
+
+    def _create_display_sink(self):
+        """
+        creation of the gtkwaylandsink element, its widget is packed into the gstwidget
+        """
+        gtkwaylandsink = Gst.ElementFactory.make("gtkwaylandsink")
+        if gtkwaylandsink:
+            self.pack_start(gtkwaylandsink.props.widget, True, True, 0)
+            gtkwaylandsink.props.widget.show()
+        return gtkwaylandsink
+
+class MainWindow(Gtk.Window):
+    """
+    This class handles all the functions necessary
+    to display video stream in GTK GUI
+    """
+    def __init__(self,app):
+        """
+        Setup instances of class and shared variables
+        useful for the application
+        """
+        Gtk.Window.__init__(self)
+        self.app = app
+        self._main_ui_creation()
+
+    def _set_ui_param(self):
+        """
+        Setup all the UI parameter
+        """
+        self.ui_icon_exit_size = '50'
+        self.ui_icon_st_width  = '130'
+        self.ui_icon_st_height = '160'
+
+    def _main_ui_creation(self):
+        """
+        Setup the Gtk UI of the main window
+        """
+        # remove the title bar
+        self.set_decorated(False)
+
+        self.first_drawing_call = True
+        GdkDisplay = Gdk.Display.get_default()
+        monitor = Gdk.Display.get_monitor(GdkDisplay, 0)
+        workarea = Gdk.Monitor.get_workarea(monitor)
+
+        GdkScreen = Gdk.Screen.get_default()
+        provider = Gtk.CssProvider()
+        css_path = RESOURCES_DIRECTORY + "Default.css"
+        self.set_name("main_window")
+        provider.load_from_path(css_path)
+        Gtk.StyleContext.add_provider_for_screen(GdkScreen, provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+        self.maximize()
+        self.screen_width = workarea.width
+        self.screen_height = workarea.height
+
+        self.set_position(Gtk.WindowPosition.CENTER)
+        self.connect('destroy', Gtk.main_quit)
+        self._set_ui_param()
+        # setup info_box containing inference results
+        # camera preview mode
+        self.info_box = Gtk.VBox()
+        self.info_box.set_name("gui_main_stbox")
+        self.st_icon_path = RESOURCES_DIRECTORY + 'ISPIQTune_' + self.ui_icon_st_width + 'x' + self.ui_icon_st_height + '.png'
+        self.st_icon = Gtk.Image.new_from_file(self.st_icon_path)
+        self.st_icon_event = Gtk.EventBox()
+        self.st_icon_event.add(self.st_icon)
+        self.info_box.pack_start(self.st_icon_event,False,False,2)
+
+        # setup video box containing gst stream in camera preview mode
+        # and a openCV picture in still picture mode
+        self.video_box = Gtk.HBox()
+        self.video_box.set_name("gui_main_video")
+
+        # camera preview => gst stream
+        self.video_widget = self.app.gst_widget
+        self.video_widget.set_app_paintable(True)
+        self.video_box.pack_start(self.video_widget, True, True, 0)
+
+        # setup the exit box which contains the exit button
+        self.exit_box = Gtk.VBox()
+        self.exit_box.set_name("gui_main_exit")
+        self.exit_icon_path = RESOURCES_DIRECTORY + 'exit_' + self.ui_icon_exit_size + 'x' +  self.ui_icon_exit_size + '.png'
+        self.exit_icon = Gtk.Image.new_from_file(self.exit_icon_path)
+        self.exit_icon_event = Gtk.EventBox()
+        self.exit_icon_event.add(self.exit_icon)
+        self.exit_box.pack_start(self.exit_icon_event,False,False,2)
+
+        # setup main box which group the three previous boxes
+        self.main_box =  Gtk.HBox()
+        self.exit_box.set_name("gui_main")
+        self.main_box.pack_start(self.info_box,False,False,0)
+        self.main_box.pack_start(self.video_box,True,True,0)
+        self.main_box.pack_start(self.exit_box,False,False,0)
+        self.add(self.main_box)
+        return True
+
+class OverlayWindow(Gtk.Window):
+    """
+    This class handles all the functions necessary
+    to display overlayed information on top of the
+    video stream
+    """
+    def __init__(self,app):
+        """
+        Setup instances of class and shared variables
+        usefull for the application
+        """
+        Gtk.Window.__init__(self)
+        self.app = app
+        self.decimation = 0
+        self.stat_area = [0, 0, 0, 0]
+        self._overlay_ui_creation()
+
+    def _set_ui_param(self):
+        """
+        Setup all the UI parameter
+        """
+        self.ui_icon_exit_size = '50'
+        self.ui_icon_st_width = '130'
+        self.ui_icon_st_height = '160'
+
+    def _exit_icon_cb(self,eventbox, event):
+        """
+        Exit callback to close application
+        """
+        self.app.exit_app()
+
+    def _overlay_ui_creation(self):
+        """
+        Setup the Gtk UI of the overlay window
+        """
+        # remove the title bar
+        self.set_decorated(False)
+
+        self.first_drawing_call = True
+        GdkDisplay = Gdk.Display.get_default()
+        monitor = Gdk.Display.get_monitor(GdkDisplay, 0)
+        workarea = Gdk.Monitor.get_workarea(monitor)
+
+        GdkScreen = Gdk.Screen.get_default()
+        provider = Gtk.CssProvider()
+        css_path = RESOURCES_DIRECTORY + "Default.css"
+        self.set_name("overlay_window")
+        provider.load_from_path(css_path)
+        Gtk.StyleContext.add_provider_for_screen(GdkScreen, provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+        self.maximize()
+        self.screen_width = workarea.width
+        self.screen_height = workarea.height
+
+        self.set_position(Gtk.WindowPosition.CENTER)
+        self.connect('destroy', Gtk.main_quit)
+        self._set_ui_param()
+
+        # setup info_box containing inference results and ST_logo which is a
+        # camera preview mode
+        self.info_box = Gtk.VBox()
+        self.info_box.set_name("gui_overlay_stbox")
+        self.st_icon_path = RESOURCES_DIRECTORY + 'ISPIQTune_' + self.ui_icon_st_width + 'x' + self.ui_icon_st_height + '.png'
+        self.st_icon = Gtk.Image.new_from_file(self.st_icon_path)
+        self.st_icon_event = Gtk.EventBox()
+        self.st_icon_event.add(self.st_icon)
+        self.info_box.pack_start(self.st_icon_event,True,True,0)
+
+        # setup video box containing a transparent drawing area
+        # to draw over the video stream
+        self.video_box = Gtk.HBox()
+        self.video_box.set_name("gui_overlay_video")
+        self.video_box.set_app_paintable(True)
+        self.drawing_area = Gtk.DrawingArea()
+        self.drawing_area.connect("draw", self.drawing)
+        self.drawing_area.set_name("overlay_draw")
+        self.drawing_area.set_app_paintable(True)
+        self.video_box.pack_start(self.drawing_area, True, True, 0)
+
+        # setup the exit box which contains the exit button
+        self.exit_box = Gtk.VBox()
+        self.exit_box.set_name("gui_overlay_exit")
+        self.exit_icon_path = RESOURCES_DIRECTORY + 'exit_' + self.ui_icon_exit_size + 'x' +  self.ui_icon_exit_size + '.png'
+        self.exit_icon = Gtk.Image.new_from_file(self.exit_icon_path)
+        self.exit_icon_event = Gtk.EventBox()
+        self.exit_icon_event.add(self.exit_icon)
+        self.exit_icon_event.connect("button_press_event",self._exit_icon_cb)
+        self.exit_box.pack_start(self.exit_icon_event,False,False,2)
+
+        # setup main box which group the three previous boxes
+        self.main_box =  Gtk.HBox()
+        self.exit_box.set_name("gui_overlay")
+        self.main_box.pack_start(self.info_box,False,False,0)
+        self.main_box.pack_start(self.video_box,True,True,0)
+        self.main_box.pack_start(self.exit_box,False,False,0)
+        self.add(self.main_box)
+        return True
+
+    def drawing(self, widget, cr):
+        """
+        Drawing callback used to draw with cairo on
+        the drawing area
+        """
+        if self.app.first_drawing_call :
+            self.app.first_drawing_call = False
+            self.drawing_width = widget.get_allocated_width()
+            self.drawing_height = widget.get_allocated_height()
+            self.label_printed = True
+            self.app.iqtune_com.start()
+            # the overlay is refreshed at the frame rate, an idle source would keep
+            # the main loop spinning
+            GLib.timeout_add(STAT_AREA_REFRESH_PERIOD, self.update_stat_area)
+
+            #adapt the drawing overlay depending on the image/camera stream displayed
+            preview_ratio = float(PREVIEW_WIDTH) / float(PREVIEW_HEIGHT)
+            self.preview_height = self.drawing_height
+            self.preview_width =  preview_ratio * self.preview_height
+            if self.preview_width >= self.drawing_width:
+                self.offset_x = 0
+                self.preview_width = self.drawing_width
+                self.preview_height = self.preview_width / preview_ratio
+                self.offset_y = (self.drawing_height - self.preview_height)/2
+            else :
+                self.offset_x = (self.drawing_width - self.preview_width)/2
+                self.offset_y = 0
+
+            return False
+
+        if self.decimation:
+            ratio_x = self.preview_width / self.app.sensor_width / self.decimation
+            ratio_y = self.preview_height / self.app.sensor_height / self.decimation
+            # Red dash line
+            cr.set_source_rgb(1.0, 0.0, 0.0)  # Red color
+            cr.set_dash([10.0, 5.0])  # 10 units dash, 5 units gap
+            cr.set_line_width(2.0)
+            # Draw the rectangle
+            cr.rectangle((self.stat_area[0] * ratio_x) + self.offset_x,
+                         (self.stat_area[1] * ratio_y) + self.offset_y,
+                         (self.stat_area[2] * ratio_x),
+                         (self.stat_area[3] * ratio_y))
+            cr.stroke()
+
+        return True
+
+    def update_stat_area(self):
+        # If new position of statistic area is detected then draw it on the overlay area
+        self.decimation = self.app.gst_widget.libcamerasrc.get_property('decimation-factor')
+        if self.decimation:
+            rectangle = self.app.gst_widget.libcamerasrc.get_property('statistic-area')
+            for elem1, elem2 in zip(rectangle, self.stat_area):
+                if elem1 != elem2:
+                    self.stat_area = rectangle
+                    self.app.update_ui()
+
+        return True
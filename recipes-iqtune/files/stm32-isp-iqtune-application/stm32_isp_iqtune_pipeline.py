@@ -0,0 +1,666 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2024 STMicroelectronics.
+# All rights reserved.
+#
+# This software is licensed under terms that can be found in the LICENSE file
+# in the root directory of this software component.
+# If no LICENSE file comes with this software, it is provided AS-IS.
+
+import re
+import threading
+from enum import Enum
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib
+from gi.repository import Gst
+
+# Static information about the preview size
+PREVIEW_WIDTH  = 640
+PREVIEW_HEIGHT = 480
+
+# Capacity of the ring of raw frames captured in burst
+BURST_MAX_FRAMES = 16
+
+# Maximum duration to wait for the main thread to run a call marshalled from
+# another thread, the GLib main loop may be blocked by the GUI or stopped
+MAIN_CONTEXT_TIMEOUT = 2.0
+
+class ISPFormatID(Enum):
+  ISP_FORMAT_RGB888   = 0x00
+  ISP_FORMAT_RAW8     = 0x01
+  ISP_FORMAT_RAW10    = 0x02
+  ISP_FORMAT_RAW12    = 0x03
+  ISP_FORMAT_RAW14    = 0x04
+
+def rgb565_to_bgr888(data, width, height, stride):
+    """
+    convert a RGB16 (RGB565) frame into a BGR888 frame
+    """
+    # numpy is only needed by the dumps, it is not loaded at startup
+    import numpy as np
+    pixels = np.frombuffer(data, dtype=np.uint16, count=height * stride // 2).reshape(height, stride // 2)[:, :width]
+    bgr = np.empty((height, width, 3), dtype=np.uint8)
+    # expand the 5/6 bits components to 8 bits by replicating their most significant bits
+    red = (pixels >> 11) & 0x1f
+    green = (pixels >> 5) & 0x3f
+    blue = pixels & 0x1f
+    bgr[..., 0] = (blue << 3) | (blue >> 2)
+    bgr[..., 1] = (green << 2) | (green >> 4)
+    bgr[..., 2] = (red << 3) | (red >> 2)
+    return bgr
+
+class DumpFrame():
+    """
+    Class that holds a dumped frame and its metadata, the frame data is either the
+    Gst sample pulled from an appsink or an array of converted pixels
+    """
+    def __init__(self, sample, array, size, width, height, pitch, format):
+        self.sample = sample
+        self.array = array
+        self.size = size
+        self.width = width
+        self.height = height
+        self.pitch = pitch
+        self.format = format
+
+    @contextmanager
+    def map(self):
+        """
+        map the frame buffer and give access to its data, None if the buffer cannot be mapped
+        """
+        if self.array is not None:
+            # converted frame
+            yield memoryview(self.array).cast('B')
+            return
+        buf = self.sample.get_buffer()
+        success, map_info = buf.map(Gst.MapFlags.READ)
+        if not success:
+            yield None
+            return
+        try:
+            yield memoryview(map_info.data)
+        finally:
+            buf.unmap(map_info)
+
+class GstPipeline():
+    """
+    Class that handles Gstreamer pipeline using appsink, the preview stream
+    ends in a fakesink when there is no display
+    """
+    def __init__(self, app):
+        self.instant_fps = 0
+        self.app = app
+        self.dump_rgb = False
+        self.dump_raw = False
+        self.dump_preview = False
+        self.dump_done = threading.Event()
+        self.dump_sample = None
+        self.dump_array = None
+        self.dump_size = 0
+        self.dump_width = 0
+        self.dump_height = 0
+        self.dump_pitch = 0
+        self.dump_format = 0
+        self.burst_frames = None
+        self.burst_nb_frames = 0
+        self.burst_count = 0
+        self.burst_width = 0
+        self.burst_height = 0
+        self.burst_pitch = 0
+        self.burst_last_buffer = None
+        self.burst_broken = False
+        self.isp_first_config = True
+        self.frame_sequence = 0
+        self.frame_cond = threading.Condition()
+        self.frame_listeners = ()
+        # property updates grouped by the transaction of each calling thread
+        self._transaction = threading.local()
+
+    def start(self):
+        self._camera_pipeline_creation()
+
+    def _create_display_sink(self):
+        """
+        creation of the sink element of the preview stream
+        """
+        return Gst.ElementFactory.make("fakesink", "fakesink")
+
+    def _camera_pipeline_creation(self):
+        """
+        creation of the gstreamer pipeline when gstwidget is created dedicated to handle
+        camera stream
+        """
+        # gstreamer pipeline creation
+        self.gst_pipeline = Gst.Pipeline.new("IQTune application")
+
+        # creation of the source element
+        self.libcamerasrc = Gst.ElementFactory.make("libcamerasrc", "libcamera")
+        if not self.libcamerasrc:
+            raise Exception("Could not create Gstreamer camera source element")
+
+        #creation of the libcamerasrc caps for the 3 pipelines
+        caps = "video/x-raw,width=" + str(PREVIEW_WIDTH) + ",height=" + str(PREVIEW_HEIGHT) + ",format=RGB16"
+        print("Main pipe configuration: ", caps)
+        caps_src = Gst.Caps.from_string(caps)
+
+        caps = "video/x-raw,width=" + str(self.app.sensor_width) + ",height=" + str(self.app.sensor_height) + ",format=RGB"
+        print("Aux pipe configuration:  ", caps)
+        caps_src0 = Gst.Caps.from_string(caps)
+
+        caps = "video/x-bayer,width=" + str(self.app.sensor_width) + ",height=" + str(self.app.sensor_height)
+        print("Dump pipe configuration: ", caps)
+        caps_src1 = Gst.Caps.from_string(caps)
+
+        # creation of the queues elements
+        queue  = Gst.ElementFactory.make("queue", "queue")
+        queue0 = Gst.ElementFactory.make("queue", "queue0")
+        queue1 = Gst.ElementFactory.make("queue", "queue1")
+        queue2 = Gst.ElementFactory.make("queue", "queue2")
+
+        # creation of the valve elements, closed while no dump is requested so that the
+        # still-capture and raw frames are dropped without reaching the application
+        self.valve0 = Gst.ElementFactory.make("valve", "valve0")
+        self.valve0.set_property("drop", True)
+        self.valve0.set_property("drop-mode", 1) # forward sticky events to keep caps negotiated
+        self.valve1 = Gst.ElementFactory.make("valve", "valve1")
+        self.valve1.set_property("drop", True)
+        self.valve1.set_property("drop-mode", 1) # forward sticky events to keep caps negotiated
+        self.valve2 = Gst.ElementFactory.make("valve", "valve2")
+        self.valve2.set_property("drop", True)
+        self.valve2.set_property("drop-mode", 1) # forward sticky events to keep caps negotiated
+
+        # creation and configuration of the appsink elements
+        self.appsink0 = Gst.ElementFactory.make("appsink", "appsink0")
+        self.appsink0.set_property("emit-signals", False)
+        self.appsink0.set_property("sync", False)
+        self.appsink0.set_property("max-buffers", 1)
+        self.appsink0.set_property("drop", True)
+        self.appsink0.connect("new-sample", self._new_sample_rgb)
+
+        self.appsink1 = Gst.ElementFactory.make("appsink", "appsink1")
+        self.appsink1.set_property("emit-signals", False)
+        self.appsink1.set_property("sync", False)
+        self.appsink1.set_property("max-buffers", 1)
+        self.appsink1.set_property("drop", True)
+        self.appsink1.connect("new-sample", self._new_sample_raw)
+
+        self.appsink2 = Gst.ElementFactory.make("appsink", "appsink2")
+        self.appsink2.set_property("emit-signals", False)
+        self.appsink2.set_property("sync", False)
+        self.appsink2.set_property("max-buffers", 1)
+        self.appsink2.set_property("drop", True)
+        self.appsink2.connect("new-sample", self._new_sample_preview)
+
+        # creation of the tee element
+        tee = Gst.ElementFactory.make("tee", "tee0")
+
+        # creation of the sink element to handle the gestreamer video stream
+        display_sink = self._create_display_sink()
+
+        # Check if all elements were created
+        if not all([self.gst_pipeline, self.libcamerasrc, queue, queue0, queue1, queue2, self.valve0, self.valve1, self.valve2, tee, display_sink, self.appsink0, self.appsink1, self.appsink2]):
+            print("Not all elements could be created. Exiting.")
+            return False
+
+        # Add all elements to the pipeline
+        self.gst_pipeline.add(self.libcamerasrc)
+        self.gst_pipeline.add(queue)
+        self.gst_pipeline.add(queue0)
+        self.gst_pipeline.add(queue1)
+        self.gst_pipeline.add(queue2)
+        self.gst_pipeline.add(self.valve0)
+        self.gst_pipeline.add(self.valve1)
+        self.gst_pipeline.add(self.valve2)
+        self.gst_pipeline.add(tee)
+        self.gst_pipeline.add(display_sink)
+        self.gst_pipeline.add(self.appsink0)
+        self.gst_pipeline.add(self.appsink1)
+        self.gst_pipeline.add(self.appsink2)
+
+        # linking elements together
+        #              | src_0 --------> valve0 -> queue0 [caps_src0] -> appsink0
+        #              | src_1 --------> valve1 -> queue1 [caps_src1] -> appsink1
+        # libcamerasrc |
+        #              |              -> queue  [caps_src] --> gtkwaylandsink or fakesink
+        #              | src   -> tee
+        #                             -> valve2 -> queue2 [caps_src] --> appsink2
+        self.valve0.link(queue0)
+        self.valve1.link(queue1)
+        queue0.link_filtered(self.appsink0, caps_src0)
+        queue1.link_filtered(self.appsink1, caps_src1)
+
+        queue.link_filtered(display_sink, caps_src)
+        # the preview frame is converted to BGR only when it is dumped
+        self.valve2.link(queue2)
+        queue2.link_filtered(self.appsink2, caps_src)
+        tee.link(queue)
+        tee.link(self.valve2)
+
+        src_pad = self.libcamerasrc.get_static_pad("src")
+        src_request_pad_template = self.libcamerasrc.get_pad_template("src_%u")
+        src_request_pad0 = self.libcamerasrc.request_pad(src_request_pad_template, None, None)
+        src_request_pad1 = self.libcamerasrc.request_pad(src_request_pad_template, None, None)
+        tee_sink_pad = tee.get_static_pad("sink")
+        valve0_sink_pad = self.valve0.get_static_pad("sink")
+        valve1_sink_pad = self.valve1.get_static_pad("sink")
+
+        # view-finder
+        src_pad.set_property("stream-role", 3)
+        # still-capture
+        src_request_pad0.set_property("stream-role", 1)
+        # raw
+        src_request_pad1.set_property("stream-role", 0)
+
+        src_pad.link(tee_sink_pad)
+
+        # count the view-finder frames to know when new settings are applied
+        src_pad.add_probe(Gst.PadProbeType.BUFFER, self._frame_probe_cb)
+        src_request_pad0.link(valve0_sink_pad)
+        src_request_pad1.link(valve1_sink_pad)
+        # the sensor pixel depth is given by the bayer format negotiated on the raw stream
+        src_request_pad1.connect("notify::caps", self._raw_caps_cb)
+
+        # appsink and valve (if any) of each stream that can be dumped
+        self.dump_streams = {
+            'rgb'     : (self.appsink0, self.valve0),
+            'raw'     : (self.appsink1, self.valve1),
+            'preview' : (self.appsink2, self.valve2),
+        }
+
+        # getting pipeline bus
+        self.bus_preview = self.gst_pipeline.get_bus()
+        self.bus_preview.add_signal_watch()
+        self.bus_preview.connect('message::error', self._msg_error_cb)
+        self.bus_preview.connect('message::eos', self._msg_eos_cb)
+        self.bus_preview.connect('message::info', self._msg_info_cb)
+        self.bus_preview.connect('message::state-changed', self._msg_state_changed_cb)
+
+        # set pipeline in playing mode
+        self.gst_pipeline.set_state(Gst.State.PLAYING)
+        self.app.startup_phase("pipeline started")
+
+        return True
+
+    def _msg_eos_cb(self, bus, message):
+        """
+        catch gstreamer end of stream signal
+        """
+        print('eos message -> {}'.format(message))
+
+    def _msg_info_cb(self, bus, message):
+        """
+        catch gstreamer info signal
+        """
+        print('info message -> {}'.format(message))
+
+    def _msg_error_cb(self, bus, message):
+        """
+        catch gstreamer error signal
+        """
+        print('error message -> {}'.format(message.parse_error()))
+
+    def _msg_state_changed_cb(self, bus, message):
+        """
+        catch gstreamer state changed signal
+        """
+        oldstate,newstate,pending = message.parse_state_changed()
+        if (oldstate == Gst.State.NULL) and (newstate == Gst.State.READY):
+            Gst.debug_bin_to_dot_file(self.gst_pipeline, Gst.DebugGraphDetails.ALL,"pipeline_py_NULL_READY")
+
+    def _raw_caps_cb(self, pad, pspec):
+        """
+        recover the sensor pixel depth from the raw stream format: bggr, bggr10le, ...
+        """
+        caps = pad.get_current_caps()
+        if caps is None:
+            return
+        match = re.match(r'[a-z]{4}(\d*)', caps.get_structure(0).get_string('format') or '')
+        if match:
+            self.app.sensor_pixel_depth = int(match.group(1) or 8)
+
+    def _frame_probe_cb(self, pad, info):
+        """
+        called in the streaming thread for each view-finder frame
+        """
+        with self.frame_cond:
+            self.frame_sequence += 1
+            self.frame_cond.notify_all()
+        if self.frame_sequence == 1:
+            self.app.startup_phase("first frame")
+        for listener in self.frame_listeners:
+            listener(self.frame_sequence)
+        return Gst.PadProbeReturn.OK
+
+    def add_frame_listener(self, listener):
+        """
+        register a function called in the streaming thread with the sequence number
+        of each view-finder frame
+        """
+        # the tuple is replaced so that the streaming thread iterates a stable snapshot
+        self.frame_listeners = self.frame_listeners + (listener,)
+
+    def remove_frame_listener(self, listener):
+        self.frame_listeners = tuple(l for l in self.frame_listeners if l != listener)
+
+    def wait_frame_sequence(self, sequence, timeout):
+        """
+        wait until the view-finder frame of the given sequence number is produced
+        """
+        with self.frame_cond:
+            return self.frame_cond.wait_for(lambda: self.frame_sequence >= sequence, timeout)
+
+    def _new_sample_rgb(self,*data):
+        """
+        recover rgb still capture frame
+        """
+        if self.dump_rgb == True:
+            self.dump_sample = None
+            self.dump_size = 0
+            self.dump_width = 0
+            self.dump_height = 0
+            self.dump_pitch = 0
+            self.dump_format = 0
+            sample = self.appsink0.emit("pull-sample")
+            if (sample):
+                buf = sample.get_buffer()
+                caps = sample.get_caps()
+
+                # keep a reference on the sample, the buffer is mapped when it is sent
+                self.dump_sample = sample
+                self.dump_size = buf.get_size()
+                self.dump_width = caps.get_structure(0).get_value('width')
+                self.dump_height = caps.get_structure(0).get_value('height')
+                self.dump_pitch = int(self.dump_size / self.dump_height)
+                self.dump_format = ISPFormatID.ISP_FORMAT_RGB888.value
+
+                self._stop_dump_stream('rgb')
+                self.dump_done.set()
+                return Gst.FlowReturn.OK
+            self._stop_dump_stream('rgb')
+            self.dump_done.set()
+            return Gst.FlowReturn.ERROR
+
+        return Gst.FlowReturn.OK
+
+    def _store_burst_frame(self):
+        """
+        copy the raw frame into the burst ring, the ring is allocated once and
+        reused by the following bursts of the same frame size
+        """
+        import numpy as np
+        sample = self.appsink1.emit("pull-sample")
+        if not sample:
+            self._stop_dump_stream('raw')
+            self.dump_done.set()
+            return Gst.FlowReturn.ERROR
+        buf = sample.get_buffer()
+        caps = sample.get_caps()
+        if self.burst_count and not self._burst_continuous(buf):
+            # a frame has been dropped by the pipeline, the burst is not consecutive
+            print("Raw frame lost during the burst capture")
+            self.burst_broken = True
+            self._stop_dump_stream('raw')
+            self.dump_done.set()
+            return Gst.FlowReturn.OK
+        self.burst_last_buffer = (buf.offset, buf.pts, buf.duration)
+        self.burst_width = caps.get_structure(0).get_value('width')
+        self.burst_height = caps.get_structure(0).get_value('height')
+        self.burst_pitch = buf.get_size() // self.burst_height
+        shape = (BURST_MAX_FRAMES, self.burst_height, self.burst_pitch // 2)
+        if self.burst_frames is None or self.burst_frames.shape != shape:
+            self.burst_frames = np.empty(shape, dtype='<u2')
+        success, map_info = buf.map(Gst.MapFlags.READ)
+        if success:
+            self.burst_frames[self.burst_count] = np.frombuffer(map_info.data, dtype='<u2',
+                                                                count=shape[1] * shape[2]).reshape(shape[1:])
+            buf.unmap(map_info)
+        self.burst_count += 1
+        if self.burst_count == self.burst_nb_frames:
+            self._stop_dump_stream('raw')
+            self.dump_done.set()
+        return Gst.FlowReturn.OK
+
+    def _burst_continuous(self, buf):
+        """
+        check that the buffer follows the previous frame of the burst, from the frame
+        sequence number carried in the offset, or else from the timestamps
+        """
+        offset, pts, duration = self.burst_last_buffer
+        if offset != Gst.BUFFER_OFFSET_NONE and buf.offset != Gst.BUFFER_OFFSET_NONE:
+            return buf.offset == offset + 1
+        if Gst.CLOCK_TIME_NONE in (pts, duration, buf.pts):
+            return True
+        return buf.pts - pts < duration * 3 // 2
+
+    def _new_sample_raw(self,*data):
+        """
+        recover raw still capture frame
+        """
+        if self.burst_count < self.burst_nb_frames and not self.burst_broken:
+            return self._store_burst_frame()
+
+        if self.dump_raw == True:
+            self.dump_sample = None
+            self.dump_size = 0
+            self.dump_width = 0
+            self.dump_height = 0
+            self.dump_pitch = 0
+            self.dump_format = 0
+            sample = self.appsink1.emit("pull-sample")
+            if (sample):
+                buf = sample.get_buffer()
+                caps = sample.get_caps()
+
+                # keep a reference on the sample, the buffer is mapped when it is sent
+                self.dump_sample = sample
+                self.dump_size = buf.get_size()
+                self.dump_width = caps.get_structure(0).get_value('width')
+                self.dump_height = caps.get_structure(0).get_value('height')
+                self.dump_pitch = int(self.dump_size / self.dump_height)
+                self.dump_format = ISPFormatID.ISP_FORMAT_RAW10.value
+
+                self._stop_dump_stream('raw')
+                self.dump_done.set()
+                return Gst.FlowReturn.OK
+            self._stop_dump_stream('raw')
+            self.dump_done.set()
+            return Gst.FlowReturn.ERROR
+
+        return Gst.FlowReturn.OK
+
+    def _new_sample_preview(self,*data):
+        """
+        recover preview frame
+        """
+        if self.dump_preview == True:
+            self.dump_array = None
+            self.dump_size = 0
+            self.dump_width = 0
+            self.dump_height = 0
+            self.dump_pitch = 0
+            self.dump_format = 0
+            sample = self.appsink2.emit("pull-sample")
+            if (sample):
+                buf = sample.get_buffer()
+                caps = sample.get_caps()
+                width = caps.get_structure(0).get_value('width')
+                height = caps.get_structure(0).get_value('height')
+
+                # convert the RGB16 preview frame into BGR
+                success, map_info = buf.map(Gst.MapFlags.READ)
+                if success:
+                    self.dump_array = rgb565_to_bgr888(map_info.data, width, height, buf.get_size() // height)
+                    buf.unmap(map_info)
+                    self.dump_size = self.dump_array.nbytes
+                    self.dump_width = width
+                    self.dump_height = height
+                    self.dump_pitch = width * 3
+                    self.dump_format = ISPFormatID.ISP_FORMAT_RGB888.value
+
+                self._stop_dump_stream('preview')
+                self.dump_done.set()
+                return Gst.FlowReturn.OK
+            self._stop_dump_stream('preview')
+            self.dump_done.set()
+            return Gst.FlowReturn.ERROR
+
+        return Gst.FlowReturn.OK
+
+    def request_dump(self, stream):
+        """
+        request the dump of the next frame of the stream: 'preview', 'rgb' or 'raw'
+        """
+        self.dump_done.clear()
+        setattr(self, 'dump_' + stream, True)
+        self._start_dump_stream(stream)
+
+    def request_burst(self, nb_frames):
+        """
+        request the capture of nb_frames consecutive raw frames into the burst ring
+        """
+        if nb_frames < 1 or nb_frames > BURST_MAX_FRAMES:
+            return False
+        self.dump_done.clear()
+        self.burst_count = 0
+        self.burst_nb_frames = nb_frames
+        self.burst_broken = False
+        # a frame queued after the previous dump closed the valve is not part of the burst
+        self._drain_raw_samples()
+        # the frames are queued while the previous ones are copied, instead of dropped
+        self.appsink1.set_property("max-buffers", nb_frames)
+        self._start_dump_stream('raw')
+        return True
+
+    def take_burst(self):
+        """
+        return the frames captured in burst with their width, height, pitch and format,
+        none of them if a frame has been lost
+        """
+        self.burst_nb_frames = 0
+        self.appsink1.set_property("max-buffers", 1)
+        # the frames queued after the end of the burst are not kept for the next dump
+        self._drain_raw_samples()
+        if self.burst_frames is None or self.burst_broken:
+            # no frame stored, or a frame has been lost
+            return ((), self.burst_width, self.burst_height, self.burst_pitch,
+                    ISPFormatID.ISP_FORMAT_RAW10.value)
+        return (self.burst_frames[:self.burst_count], self.burst_width, self.burst_height,
+                self.burst_pitch, ISPFormatID.ISP_FORMAT_RAW10.value)
+
+    def _drain_raw_samples(self):
+        """
+        drop the raw samples queued in the appsink, they are older than the next request
+        """
+        while self.appsink1.emit("try-pull-sample", 0):
+            pass
+
+    def _start_dump_stream(self, stream):
+        """
+        let the frames of the stream reach the application until they are dumped
+        """
+        appsink, valve = self.dump_streams[stream]
+        appsink.set_property("emit-signals", True)
+        if valve is not None:
+            valve.set_property("drop", False)
+
+    def _stop_dump_stream(self, stream):
+        """
+        stop the frames of the stream from reaching the application
+        """
+        setattr(self, 'dump_' + stream, False)
+        if stream == 'raw':
+            self.burst_nb_frames = 0
+        appsink, valve = self.dump_streams[stream]
+        if valve is not None:
+            valve.set_property("drop", True)
+        appsink.set_property("emit-signals", False)
+
+    def wait_dump(self, timeout):
+        """
+        wait for the requested frame to be dumped by the appsink streaming thread,
+        the request is cancelled on timeout
+        """
+        if self.dump_done.wait(timeout):
+            return True
+        for stream in self.dump_streams:
+            self._stop_dump_stream(stream)
+        return False
+
+    def take_dump(self):
+        """
+        return the dumped frame, the application holds it until it is released
+        """
+        frame = DumpFrame(self.dump_sample, self.dump_array, self.dump_size, self.dump_width,
+                          self.dump_height, self.dump_pitch, self.dump_format)
+        self.dump_sample = None
+        self.dump_array = None
+        return frame
+
+    def _call_in_main_context(self, func, *args):
+        """
+        run func from the main thread running the GLib main loop and return its result:
+        the properties accessed from the command server thread are marshalled this way.
+        TimeoutError is raised when the main thread does not run it in time.
+        """
+        if threading.current_thread() is threading.main_thread():
+            return func(*args)
+        result = Future()
+        def invoke():
+            # the call given up on timeout is not run afterwards
+            if result.set_running_or_notify_cancel():
+                try:
+                    result.set_result(func(*args))
+                except Exception as exc:
+                    result.set_exception(exc)
+            return False
+        GLib.idle_add(invoke, priority=GLib.PRIORITY_HIGH)
+        try:
+            return result.result(MAIN_CONTEXT_TIMEOUT)
+        except FutureTimeoutError:
+            result.cancel()
+            raise TimeoutError("main thread not responding to " + getattr(func, '__name__', 'call'))
+
+    def set_libcamera_property(self, property, value):
+        properties = getattr(self._transaction, 'properties', None)
+        if properties is not None:
+            properties[property] = value
+            return
+        self._call_in_main_context(self.libcamerasrc.set_property, property, value)
+
+    @contextmanager
+    def transaction(self):
+        """
+        group the property updates of the calling thread until the end of the block
+        and commit them together with a single marshalling to the main thread, so
+        that they are pending in libcamerasrc for the same request. The nested
+        transactions are part of the outer one.
+        """
+        if getattr(self._transaction, 'properties', None) is not None:
+            yield
+            return
+        self._transaction.properties = properties = {}
+        try:
+            yield
+        finally:
+            self._transaction.properties = None
+        if properties:
+            self._call_in_main_context(self._commit_properties, properties)
+
+    def _commit_properties(self, properties):
+        # the updates are applied back to back, in the order of their first update
+        with self.libcamerasrc.freeze_notify():
+            for property, value in properties.items():
+                self.libcamerasrc.set_property(property, value)
+
+    def get_libcamera_property(self, property):
+        return self._call_in_main_context(self.libcamerasrc.get_property, property)
+
+    def get_libcamera_properties(self, *properties):
+        """
+        read several properties with a single marshalling to the main thread
+        """
+        return self._call_in_main_context(lambda: [self.libcamerasrc.get_property(property)
+                                                   for property in properties])
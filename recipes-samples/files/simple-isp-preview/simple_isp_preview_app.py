@@ -8,7 +8,11 @@
 # If no LICENSE file comes with this software, it is provided AS-IS.
 
 import os
-os.environ['GST_DEBUG'] = '1'
+# quiet GStreamer by default, the debug level can still be set by the user
+os.environ.setdefault('GST_DEBUG', '1')
+import time
+# origin of the startup timeline, taken before the heavy imports and initializations
+STARTUP_TIME = time.monotonic()
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gst', '1.0')
@@ -19,17 +23,25 @@ import signal
 import subprocess
 import os.path
 import re
-
-# Init gstreamer
-Gst.init(None)
-Gst.init_check(None)
-# Init gtk
-Gtk.init(None)
-Gtk.init_check(None)
+import glob
+import json
 
 # Path definition
 RESOURCES_DIRECTORY = os.path.abspath(os.path.dirname(__file__)) + "/resources/"
 
+# Persistent cache of the sensor information, to skip the camera capture at startup.
+# It is kept in the cache directory of the user, the application being launched as
+# the weston user which cannot write to /var/cache
+SENSOR_INFO_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser("~/.cache"),
+                                 "simple-isp-preview", "sensor_info.json")
+
+# Sensor properties and controls listed by the cam utility, the last occurrence is kept
+SENSOR_INFO_PATTERN = re.compile(r'Property: Model = (?P<name>\w+)'
+                                 r'|Property: ColorFilterArrangement = (?P<bayer_pattern>\d+)'
+                                 r'|Property: PixelArraySize = (?P<width>\d+)x(?P<height>\d+)'
+                                 r'|Control: ExposureTime: \[(?P<expo_min>\d+)\.\.(?P<expo_max>\d+)\]'
+                                 r'|Control: AnalogueGain_dB: \[(?P<gain_min>[0-9.]+)\.\.(?P<gain_max>[0-9.]+)\]')
+
 # Static information about the preview size
 PREVIEW_WIDTH  = 640
 PREVIEW_HEIGHT = 480
@@ -93,6 +105,7 @@ class GstWidget(Gtk.Box):
 
         # view-finder
         src_pad.set_property("stream-role", 3)
+        src_pad.add_probe(Gst.PadProbeType.BUFFER, self._first_frame_probe_cb)
 
         # getting pipeline bus
         self.bus_preview = self.gst_pipeline.get_bus()
@@ -104,9 +117,17 @@ class GstWidget(Gtk.Box):
 
         # set pipeline in playing mode
         self.gst_pipeline.set_state(Gst.State.PLAYING)
+        self.app.startup_phase("pipeline started")
 
         return True
 
+    def _first_frame_probe_cb(self, pad, info):
+        """
+        called in the streaming thread for the first view-finder frame only
+        """
+        self.app.startup_phase("first frame")
+        return Gst.PadProbeReturn.REMOVE
+
     def _msg_eos_cb(self, bus, message):
         """
         catch gstreamer end of stream signal
@@ -370,8 +391,11 @@ class Application:
         self.sensor_expo_max = None
         self.sensor_gain_min = None
         self.sensor_gain_max = None
+        self.startup_phase("gstreamer and gtk initialized")
         self.get_sensor_information()
+        self.startup_phase("sensor information")
         self.get_display_resolution()
+        self.startup_phase("display resolution")
 
         #instantiate the Gstreamer pipeline
         self.gst_widget = GstWidget(self)
@@ -380,53 +404,95 @@ class Application:
         #instantiate the overlay window
         self.overlay_window = OverlayWindow(self)
         self.show_all()
-
-    def get_sensor_information(self):
-        tmp_file = "/tmp/sensor_info.txt"
-        cmd = "cam -c1 -C15 --list-controls --list-properties --meta >> " + tmp_file
-        subprocess.run(cmd, shell=True)
-
-        # Check if /tmp/sensor_info.txt file exists
-        if not os.path.exists(tmp_file):
+        self.startup_phase("windows shown")
+
+    def startup_phase(self, phase):
+        """
+        print the time elapsed since the application start at the end of a startup phase
+        """
+        print("Startup timeline: %-30s %8.1f ms" % (phase, (time.monotonic() - STARTUP_TIME) * 1000))
+
+    def get_media_topology(self):
+        """
+        identify the camera hardware from the names of the media devices and of
+        their sub-devices, None if they are not exposed
+        """
+        names = []
+        for pattern in ("/sys/bus/media/devices/*/model", "/sys/class/video4linux/v4l-subdev*/name"):
+            for path in sorted(glob.glob(pattern)):
+                try:
+                    with open(path, 'r') as file:
+                        names.append(file.read().strip())
+                except OSError:
+                    pass
+        return ";".join(names) if names else None
+
+    def load_sensor_info_cache(self, topology):
+        """
+        return the cached sensor information if it has been discovered on the same hardware
+        """
+        if topology is None:
+            return None
+        try:
+            with open(SENSOR_INFO_CACHE, 'r') as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if cache.get('topology') != topology:
+            return None
+        return cache.get('info')
+
+    def save_sensor_info_cache(self, topology, info):
+        if topology is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(SENSOR_INFO_CACHE), exist_ok=True)
+            with open(SENSOR_INFO_CACHE, 'w') as file:
+                json.dump({'topology': topology, 'info': info}, file)
+        except OSError as e:
+            print("Fail to save sensor information cache: " + str(e))
+
+    def discover_sensor_information(self):
+        """
+        list the properties and controls of the camera with the cam utility, without
+        starting any capture
+        """
+        cmd = ["cam", "-c1", "--list-controls", "--list-properties"]
+        try:
+            output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+        except OSError:
             print("Fail to recover sensor information.")
             print("The application cannot start")
             os._exit(1)
+
+        info = {}
+        for match in SENSOR_INFO_PATTERN.finditer(output):
+            info.update({key: value for key, value in match.groupdict().items() if value is not None})
+        return info
+
+    def get_sensor_information(self):
+        topology = self.get_media_topology()
+        info = self.load_sensor_info_cache(topology)
+        if info is None:
+            info = self.discover_sensor_information()
+            if len(info) == SENSOR_INFO_PATTERN.groups:
+                self.save_sensor_info_cache(topology, info)
         else:
-            # Define the regular expression pattern
-            pattern_name = r'Property: Model = (\w+)'
-            pattern_bayer_arrangement = r'Property: ColorFilterArrangement = (\d+)'
-            pattern_pixel_depth = r'SensorBitsPerPixel = (\d+)'
-            pattern_resolution = r'Property: PixelArraySize = (\d+)x(\d+)'
-            pattern_expo = r'Control: ExposureTime: \[(\d+)\.\.(\d+)\]'
-            pattern_gain = r'Control: AnalogueGain_dB: \[([0-9.]+)\.\.([0-9.]+)\]'
-
-            # Read the file and search for the pattern
-            with open(tmp_file, 'r') as file:
-                for line in file:
-                    match = re.search(pattern_name, line)
-                    if match:
-                        self.sensor_name = str(match.group(1))
-                    match = re.search(pattern_bayer_arrangement, line)
-                    if match:
-                        self.sensor_bayer_pattern = int(match.group(1))
-                    match = re.search(pattern_pixel_depth, line)
-                    if match:
-                        self.sensor_pixel_depth = int(match.group(1))
-                    match = re.search(pattern_resolution, line)
-                    if match:
-                        self.sensor_width  = int(match.group(1))
-                        self.sensor_height = int(match.group(2))
-                    match = re.search(pattern_expo, line)
-                    if match:
-                        self.sensor_expo_min = int(match.group(1))
-                        self.sensor_expo_max = int(match.group(2))
-                    match = re.search(pattern_gain, line)
-                    if match:
-                        self.sensor_gain_min = int(float(match.group(1)))
-                        self.sensor_gain_max = int(float(match.group(2)))
-
-            # remove the temporary file
-            os.remove(tmp_file)
+            print("Sensor information recovered from cache")
+
+        if 'name' in info:
+            self.sensor_name = str(info['name'])
+        if 'bayer_pattern' in info:
+            self.sensor_bayer_pattern = int(info['bayer_pattern'])
+        if 'width' in info and 'height' in info:
+            self.sensor_width  = int(info['width'])
+            self.sensor_height = int(info['height'])
+        if 'expo_min' in info and 'expo_max' in info:
+            self.sensor_expo_min = int(info['expo_min'])
+            self.sensor_expo_max = int(info['expo_max'])
+        if 'gain_min' in info and 'gain_max' in info:
+            self.sensor_gain_min = int(float(info['gain_min']))
+            self.sensor_gain_max = int(float(info['gain_max']))
 
         if self.sensor_name is None:
             print("Sensor information: fail to get sensor name")
@@ -453,32 +519,38 @@ class Application:
 
     def get_display_resolution(self):
         """
-        Used to ask the system for the display resolution
-        """
-        cmd = "modetest -M stm -c > /tmp/display_resolution.txt"
-        subprocess.run(cmd, shell=True)
-        display_info_pattern = "#0"
-        display_information = ""
-        display_resolution = ""
-        display_width = ""
-        display_height = ""
-
-        f = open("/tmp/display_resolution.txt", "r")
-        for line in f :
-            if display_info_pattern in line:
-                display_information = line
-        display_information_splited = display_information.split()
-        for i in display_information_splited :
-            if "x" in i :
-                display_resolution = i
-        display_resolution = display_resolution.replace('x',' ')
-        display_resolution = display_resolution.split()
-        display_width = display_resolution[0]
-        display_height = display_resolution[1]
+        Used to ask the system for the display resolution: the geometry of the
+        first monitor known by GDK, else the preferred mode of the connected DRM
+        connector
+        """
+        display_width = 0
+        display_height = 0
+
+        GdkDisplay = Gdk.Display.get_default()
+        monitor = GdkDisplay.get_monitor(0) if GdkDisplay is not None else None
+        if monitor is not None:
+            geometry = monitor.get_geometry()
+            display_width = geometry.width * monitor.get_scale_factor()
+            display_height = geometry.height * monitor.get_scale_factor()
+        else:
+            for connector in sorted(glob.glob("/sys/class/drm/card*-*/")):
+                try:
+                    with open(connector + "status", "r") as f:
+                        if f.read().strip() != "connected":
+                            continue
+                    with open(connector + "modes", "r") as f:
+                        mode = f.readline().strip()
+                except OSError:
+                    continue
+                match = re.match(r'(\d+)x(\d+)', mode)
+                if match:
+                    display_width = int(match.group(1))
+                    display_height = int(match.group(2))
+                    break
 
         print("display resolution is : ",display_width, " x ", display_height)
-        self.window_width = int(display_width)
-        self.window_height = int(display_height)
+        self.window_width = display_width
+        self.window_height = display_height
         return 0
 
     # Updating the labels and the inference infos displayed on the GUI interface - camera input
@@ -518,6 +590,10 @@ if __name__ == '__main__':
     # add signal to catch CRTL+C
     signal.signal(signal.SIGINT, signal_handler)
 
+    # Init gstreamer and gtk once, the plugin registry is scanned here
+    Gst.init(None)
+    Gtk.init(None)
+
     #Application initialisation
     try:
         application = Application()